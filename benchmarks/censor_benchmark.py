@@ -0,0 +1,103 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# Compares censoring a caption with one regular expression per censored word, as the
+# transcribe engine used to, against the compiled word matcher. The censor column is the
+# Censor the engine calls, including its check of the censored words for changes, and the
+# word list columns censor the words of the caption one by one and in one pass.
+#   python benchmarks/censor_benchmark.py
+
+import os
+import random
+import re
+import string
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import speakreader
+from speakreader.wordMatcher import Censor, WordMatcher
+
+SIZES = (10, 1000, 10000)
+
+# Seconds each measurement runs for.
+MEASURE_SECS = 1.0
+
+CAPTION = ("so what we are going to talk about today is how the new schedule will work for everybody "
+           "and what changes you can expect when the building reopens next month")
+
+
+def perWordCensor(words, text):
+    for word in words:
+        if len(word) > 1:
+            regex = re.compile(r'\b{0}\b'.format("(" + word[0] + ")" + word[1:]), re.IGNORECASE)
+            text = regex.sub(r"\1" + "*" * (len(word) - 1), text)
+    return text
+
+
+def matcherCensor(matcher, text):
+    return matcher.sub(lambda match: match.group()[0] + "*" * (len(match.group()) - 1), text)
+
+
+def measure(function):
+    """ Returns the seconds per call of a function. """
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MEASURE_SECS:
+            return elapsed / calls
+
+
+def censoredWords(count, rng):
+    # Include some words of the caption so that there is something to censor.
+    words = set(rng.sample(CAPTION.split(), 5))
+    while len(words) < count:
+        words.add(''.join(rng.choice(string.ascii_lowercase) for i in range(rng.randint(3, 10))))
+    return sorted(words)[:count]
+
+
+def main():
+    rng = random.Random(1)
+    captionWords = CAPTION.split()
+    print("%8s %14s %14s %14s %10s %14s %14s %14s" % ("words", "per-word", "matcher", "build", "speedup",
+                                                      "censor", "word by word", "word list"))
+    for size in SIZES:
+        words = censoredWords(size, rng)
+        start = time.perf_counter()
+        matcher = WordMatcher(words)
+        build = time.perf_counter() - start
+
+        speakreader.CONFIG = types.SimpleNamespace(CENSORED_WORDS=words)
+        censor = Censor()
+        assert matcherCensor(matcher, CAPTION) == perWordCensor(words, CAPTION) == censor(CAPTION)
+        assert censor.words(captionWords) == [censor(word) for word in captionWords]
+
+        old = measure(lambda: perWordCensor(words, CAPTION))
+        new = measure(lambda: matcherCensor(matcher, CAPTION))
+        censored = measure(lambda: censor(CAPTION))
+        wordByWord = measure(lambda: [censor(word) for word in captionWords])
+        wordList = measure(lambda: censor.words(captionWords))
+        print("%8d %11.1f us %11.1f us %11.1f ms %9.0fx %11.1f us %11.1f us %11.1f us"
+              % (size, old * 1e6, new * 1e6, build * 1e3, old / new, censored * 1e6, wordByWord * 1e6, wordList * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# Measures the time the post-processing rules add to each caption, for an interim and a
+# final result, as the number of rules grows, and the time the number formatting adds.
+# The number formatting is first checked against NUMBER_CASES.
+#   python benchmarks/rules_benchmark.py
+
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speakreader.postProcessor import RuleSet, NumberFormatter
+
+SIZES = (10, 1000, 10000)
+
+# Seconds each measurement runs for.
+MEASURE_SECS = 1.0
+
+INTERIM = "so what we are going to talk about today"
+FINAL = ("so what we are going to talk about today is how the nasa schedule will work for everybody "
+         "and what changes you can expect when speak reader reopens at one hundred percent next month")
+
+RULES = [
+    ("nasa", "NASA"),
+    ("speak reader", "SpeakReader"),
+    ("one hundred percent", "100%"),
+]
+
+# Captions and how the number formatting writes them.
+NUMBER_CASES = [
+    ("we need twenty five chairs", "we need 25 chairs"),
+    ("three thousand two hundred and five people", "3205 people"),
+    ("forty two thousand five hundred and sixty one", "42,561"),
+    ("in nineteen eighty four", "in 1984"),
+    ("nineteen oh five", "1905"),
+    ("twenty twenty one was hard", "2021 was hard"),
+    ("page forty-two", "page 42"),
+    ("one hundred and", "100 and"),
+    ("one of them", "one of them"),
+    ("the Ten Commandments", "the Ten Commandments"),
+    ("twelve apostles", "twelve apostles"),
+    ("nine eleven", "nine eleven"),
+    ("seven eleven store", "seven eleven store"),
+    ("ten ten ten", "ten ten ten"),
+    ("sixty seventy", "sixty seventy"),
+    ("a thousand", "a thousand"),
+    ("tone anyone", "tone anyone"),
+]
+
+
+def measure(function):
+    """ Returns the seconds per call of a function. """
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MEASURE_SECS:
+            return elapsed / calls
+
+
+def rules(count, rng):
+    phrases = {phrase for phrase, replacement in RULES}
+    generated = list(RULES)
+    while len(generated) < count:
+        words = ' '.join(''.join(rng.choice(string.ascii_lowercase) for i in range(rng.randint(3, 9)))
+                         for j in range(rng.randint(1, 3)))
+        if words not in phrases:
+            phrases.add(words)
+            generated.append((words, words.upper()))
+    return generated[:count]
+
+
+def main():
+    rng = random.Random(1)
+    print("%8s %12s %12s %12s" % ("rules", "interim", "final", "build"))
+    for size in SIZES:
+        start = time.perf_counter()
+        ruleSet = RuleSet(rules(size, rng))
+        build = time.perf_counter() - start
+
+        assert "NASA" in ruleSet.apply(FINAL) and "SpeakReader" in ruleSet.apply(FINAL) and "100%" in ruleSet.apply(FINAL)
+
+        interim = measure(lambda: ruleSet.apply(INTERIM))
+        final = measure(lambda: ruleSet.apply(FINAL))
+        print("%8d %9.1f us %9.1f us %9.1f ms" % (size, interim * 1e6, final * 1e6, build * 1e3))
+
+    numberFormatter = NumberFormatter()
+    for caption, expected in NUMBER_CASES:
+        assert numberFormatter.apply(caption) == expected, (caption, numberFormatter.apply(caption), expected)
+    assert "100 percent" in numberFormatter.apply(FINAL)
+    interim = measure(lambda: numberFormatter.apply(INTERIM))
+    final = measure(lambda: numberFormatter.apply(FINAL))
+    print("%8s %9.1f us %9.1f us" % ("numbers", interim * 1e6, final * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# Compares the CPU time of sending the transcript so far to a new listener, as it used to
+# be, read from the file and rendered for each one, against copying the reload frame of
+# the snapshot, for transcripts of a few lengths.
+#   python benchmarks/snapshot_benchmark.py
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speakreader.queueManager import Snapshot, encodeEvent
+
+PARAGRAPHS = (100, 1000, 5000)
+
+# Seconds each measurement runs for.
+MEASURE_SECS = 1.0
+
+PARAGRAPH = "and what changes you can expect when the building reopens next month"
+
+
+def fromFile(filename):
+    with open(filename, 'r') as f:
+        paragraphs = f.read().rstrip("\n\n").split("\n\n")
+    encodeEvent({"event": "transcript", "final": "reload", "record": "<p>" + "</p><p>".join(paragraphs) + "</p>"})
+
+
+def fromSnapshot(snapshot):
+    b'id: 0-0\n' + snapshot.render().frame
+
+
+def measure(function):
+    """ Returns the CPU seconds per call of a function. """
+    calls = 0
+    start = time.process_time()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.process_time() - start
+        if elapsed >= MEASURE_SECS:
+            return elapsed / calls
+
+
+def main():
+    print("%10s %16s %16s %10s" % ("paragraphs", "from file", "snapshot", "speedup"))
+    for size in PARAGRAPHS:
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write((PARAGRAPH + "\n\n") * size)
+        try:
+            snapshot = Snapshot("transcript")
+            snapshot.reset([PARAGRAPH] * size)
+            old = measure(lambda: fromFile(f.name))
+            new = measure(lambda: fromSnapshot(snapshot))
+        finally:
+            os.remove(f.name)
+        print("%10d %13.1f us %13.1f us %9.0fx" % (size, old * 1e6, new * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# Compares the CPU time spent delivering one caption event to all its listeners, as it
+# used to be, copied into a queue per listener and encoded by each connection, against
+# publishing it to the ring once as a frame that every connection reads.
+#   python benchmarks/sse_benchmark.py
+
+import json
+import os
+import queue
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speakreader import queueManager
+from speakreader.queueManager import EventRing, ListenerCursor
+
+SIZES = (10, 100, 1000)
+
+# Seconds each measurement runs for.
+MEASURE_SECS = 1.0
+
+EVENT = {"event": "transcript", "final": False, "keep": 84,
+         "append": "and what changes you can expect when the building reopens next month"}
+
+
+def perConnection(queues):
+    for listenerQueue in queues:
+        listenerQueue.put_nowait(EVENT)
+    for listenerQueue in queues:
+        data = listenerQueue.get(timeout=0)
+        'data: {}\n\n'.format(json.dumps(data)).encode('utf-8')
+
+
+def encodedOnce(ring, cursors):
+    ring.append(EVENT)
+    for cursor in cursors:
+        cursor.get(timeout=0)
+
+
+def measure(function):
+    """ Returns the CPU seconds per call of a function. """
+    calls = 0
+    start = time.process_time()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.process_time() - start
+        if elapsed >= MEASURE_SECS:
+            return elapsed / calls
+
+
+def main():
+    print("JSON encoder: %s" % ("orjson" if queueManager.orjson is not None else "json"))
+    print("%10s %16s %16s %10s" % ("listeners", "per-connection", "encoded once", "speedup"))
+    for size in SIZES:
+        ring = EventRing(queueManager.RING_SIZE)
+        cursors = [ListenerCursor(ring, 'transcript', '127.0.0.1', str(i)) for i in range(size)]
+        queues = [queue.Queue(maxsize=20) for i in range(size)]
+        old = measure(lambda: perConnection(queues))
+        new = measure(lambda: encodedOnce(ring, cursors))
+        print("%10d %13.1f us %13.1f us %9.1fx" % (size, old * 1e6, new * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,7 @@
 var noSleep = new NoSleep();
 var sessionID = "";
 var transcriptStream = "";
+var interimText = "";
 
 
 // Determine where the scroll target is.
@@ -61,8 +62,31 @@ function startTranscriptStream() {
         }, false);
     }
 
+    // /listen?lang=es shows the captions in another language.
+    var lang = new URLSearchParams(window.location.search).get('lang');
+    var langParam = lang ? '&lang=' + encodeURIComponent(lang) : '';
+
+    // The transcript so far comes from the browser cache when it has not changed. The stream
+    // then leaves it out, unless a final was added in between.
+    $.ajax({
+        url: '/transcriptSnapshot?' + langParam.substring(1),
+        dataType: 'html',
+        success: function (html, status, xhr) {
+            interimText = "";
+            $("#transcript").html(html).append('<p></p>');
+            scrollTarget.scrollTop(scrollTarget.prop("scrollHeight"));
+            var etag = xhr.getResponseHeader('ETag');
+            openTranscriptStream(langParam + (etag ? '&etag=' + encodeURIComponent(etag) : ''));
+        },
+        error: function () {
+            openTranscriptStream(langParam);
+        }
+    });
+};
+
+function openTranscriptStream(params) {
     // Create Transcript Stream.
-    transcriptStream = new EventSource('/addListener?type=transcript');
+    transcriptStream = new EventSource('/addListener?type=transcript' + params);
     transcriptStream.onmessage = function (e) {
         var data = JSON.parse(e.data);
 
@@ -88,8 +112,14 @@ function startTranscriptStream() {
                 var atBottom = scrollTarget.prop("scrollTop") + ch >= scrollTarget.prop("scrollHeight") - 10;
 
                 if ( data.final === "reload" ) {
+                    interimText = "";
                     $("#transcript").html(data.record);
+                } else if ( data.keep !== undefined ) {
+                    // Interim results keep the start of the previous interim result and append the rest.
+                    interimText = interimText.substring(0, data.keep) + data.append;
+                    $("#transcript p:last-child").html(interimText);
                 } else {
+                    interimText = data.final ? "" : data.record;
                     $("#transcript p:last-child").html(data.record);
                 }
 
@@ -45,4 +45,8 @@ setup(
         'ibm-watson',
         'azure-cognitiveservices-speech; (sys_platform in "win32 macos") or (sys_platform == "linux" and platform_machine in "AMD64")',
     ],
+    extras_require={
+        # Offline recognition. Its wheels are not built for every platform.
+        'vosk': ['vosk'],
+    },
 )
@@ -35,7 +35,9 @@ except ImportError:
 
 from speakreader import webstart, logger, config, version
 from speakreader.versionMgmt import Version
-from speakreader.transcribeEngine import TranscribeEngine
+from speakreader.transcribeEngine import TranscribeEngine, recognizerClass
+from speakreader.batchTranscribe import BatchJob, outputFilename
+from speakreader.resultCache import ResultCache, RESULT_CACHE_FILENAME
 
 PROG_DIR = None
 DATA_DIR = None
@@ -52,6 +54,8 @@ class SpeakReader(object):
     _INITIALIZED = False
     SIGNAL = None
     transcribeEngine = None
+    batchJobs = []
+    resultCache = None
     HTTP_PORT = None
     _INPUT_DEVICE = None
 
@@ -125,6 +129,8 @@ class SpeakReader(object):
 
             if CONFIG.START_TRANSCRIBE_ON_STARTUP :
                 self.startTranscribeEngine()
+            else:
+                self.prewarmTranscribeEngine()
 
             ###################################################################################################
             #  Initialize the webserver
@@ -150,6 +156,8 @@ class SpeakReader(object):
             self.cleanup_files()
             self.scheduler = BackgroundScheduler()
             self.scheduler.add_job(self.cleanup_files, 'interval', hours=24)
+            # Transcripts saved before the transcript store existed are imported for search.
+            self.scheduler.add_job(self.backfillTranscripts)
             self.scheduler.start()
 
             SpeakReader._INITIALIZED = True
@@ -170,21 +178,47 @@ class SpeakReader(object):
             logger.warn("No Input Devices Available. Can't start Transcribe Engine.")
             return
 
-        if CONFIG.SPEECH_TO_TEXT_SERVICE == 'google':
+        message = self.checkService(CONFIG.SPEECH_TO_TEXT_SERVICE)
+        if message is not None:
+            logger.warn(message + " Can't start Transcribe Engine.")
+            return
+
+        standbyService = CONFIG.SPEECH_TO_TEXT_STANDBY_SERVICE
+        if standbyService == CONFIG.SPEECH_TO_TEXT_SERVICE:
+            standbyService = ""
+        if standbyService:
+            message = self.checkService(standbyService)
+            if message is not None:
+                logger.warn(message + " Standby Speech-To-Text Service disabled.")
+                standbyService = ""
+
+        self.transcribeEngine.start(standbyService=standbyService)
+
+    ###################################################################################################
+    #  Connect the configured Speech-To-Text Services so that the next start is quick
+    ###################################################################################################
+    def prewarmTranscribeEngine(self):
+        services = [service for service in (CONFIG.SPEECH_TO_TEXT_SERVICE, CONFIG.SPEECH_TO_TEXT_STANDBY_SERVICE)
+                    if service and self.checkService(service) is None]
+        if services:
+            self.transcribeEngine.prewarm(services)
+
+    ###################################################################################################
+    #  Check the settings of a Speech-To-Text Service. Returns None if it can be used.
+    ###################################################################################################
+    def checkService(self, service):
+        if service == 'google':
             if CONFIG.GOOGLE_CREDENTIALS_FILE == "":
-                logger.warn("API Credentials not available. Can't start Transcribe Engine.")
-                return
+                return "API Credentials not available."
             try:
                 with open(CONFIG.GOOGLE_CREDENTIALS_FILE) as f:
                     json.loads(f.read())
             except json.decoder.JSONDecodeError:
-                logger.warn("API Credentials does not appear to be a valid JSON file. Can't start Transcribe Engine.")
-                return
+                return "API Credentials does not appear to be a valid JSON file."
 
-        elif CONFIG.SPEECH_TO_TEXT_SERVICE == 'IBM':
+        elif service == 'IBM':
             if CONFIG.IBM_CREDENTIALS_FILE == "":
-                logger.warn("API Credentials not available. Can't start Transcribe Engine.")
-                return
+                return "API Credentials not available."
 
             APIKEY = None
             URL = None
@@ -199,18 +233,64 @@ class SpeakReader(object):
             except:
                 pass
             if APIKEY is None or URL is None:
-                logger.warn("APIKEY or URL not found in IBM credentials file. Can't start Transcribe Engine.")
-                return
+                return "APIKEY or URL not found in IBM credentials file."
 
-        elif CONFIG.SPEECH_TO_TEXT_SERVICE == 'microsoft':
+        elif service == 'microsoft':
             if CONFIG.MICROSOFT_SERVICE_APIKEY == "" or CONFIG.MICROSOFT_SERVICE_REGION == "":
-                logger.warn("Microsoft Azure APIKEY and Region are required. Can't start Transcribe Engine.")
-                return
+                return "Microsoft Azure APIKEY and Region are required."
+
+        elif service == 'vosk':
+            if CONFIG.VOSK_MODEL_PATH == "" or not os.path.isdir(CONFIG.VOSK_MODEL_PATH):
+                return "Vosk model folder not found."
+
+        elif service == 'fake':
+            logger.warn("Using the test speech service. The transcript is scripted.")
 
         else:
-            return
+            return "Unknown Speech-To-Text Service %s." % service
 
-        self.transcribeEngine.start()
+        return None
+
+    ###################################################################################################
+    #  Transcribe a saved recording again. Returns None if the job was started, else an error message.
+    ###################################################################################################
+    def startBatchTranscription(self, recording, service=None):
+        service = service or CONFIG.SPEECH_TO_TEXT_SERVICE
+        message = self.checkService(service)
+        if message is not None:
+            return message
+
+        serviceClass = recognizerClass(service)
+        if serviceClass is None:
+            return "The %s Speech-To-Text Service is not supported." % service
+
+        filename = os.path.join(CONFIG.RECORDINGS_FOLDER, os.path.basename(recording))
+        if not os.path.isfile(filename):
+            return "Recording %s not found." % os.path.basename(recording)
+
+        if any(job.is_running and job.recording == filename for job in self.batchJobs):
+            return "Recording %s is already being transcribed." % os.path.basename(recording)
+
+        # Keep the finished jobs of the last few runs for the status page.
+        self.batchJobs = [job for job in self.batchJobs if job.is_running] + \
+                         [job for job in self.batchJobs if not job.is_running][-4:]
+
+        logger.info("Transcribing recording %s with the %s Speech-To-Text Service" % (os.path.basename(recording), service))
+        job = BatchJob(filename, outputFilename(filename), serviceClass, CONFIG.BATCH_WORKERS, self.getResultCache())
+        self.batchJobs.append(job)
+        job.start()
+        return None
+
+    def getResultCache(self):
+        if CONFIG.RESULT_CACHE_MB <= 0:
+            return None
+        if self.resultCache is None:
+            self.resultCache = ResultCache(os.path.join(DATA_DIR, RESULT_CACHE_FILENAME), CONFIG.RESULT_CACHE_MB * 1024 * 1024)
+        self.resultCache.max_bytes = CONFIG.RESULT_CACHE_MB * 1024 * 1024
+        return self.resultCache
+
+    def getBatchStatus(self):
+        return [job.getStatus() for job in self.batchJobs]
 
     ###################################################################################################
     #  Stop the Transcribe Engine
@@ -295,13 +375,20 @@ class SpeakReader(object):
     ###################################################################################################
     #  Delete any files over the retention days
     ###################################################################################################
+    def backfillTranscripts(self):
+        store = self.transcribeEngine.transcriptStore
+        imported = store.backfill(CONFIG.TRANSCRIPTS_FOLDER)
+        if imported:
+            logger.info("Imported %d transcripts into the transcript store" % imported)
+
     def cleanup_files(self):
         logger.info("Running File Cleanup")
         def delete(path, days):
+            deleted = []
             try:
                 days = int(days)
             except ValueError:
-                return
+                return deleted
             delete_date = datetime.datetime.now() - datetime.timedelta(days=days)
             with os.scandir(path=path) as files:
                 for file in files:
@@ -310,12 +397,15 @@ class SpeakReader(object):
                         filename = os.path.join(path, file.name)
                         logger.debug("Deleting: %s" % filename)
                         os.remove(filename)
+                        deleted.append(file.name)
+            return deleted
 
         if CONFIG.LOG_RETENTION_DAYS != "":
             delete(CONFIG.LOG_DIR, CONFIG.LOG_RETENTION_DAYS)
 
         if CONFIG.TRANSCRIPT_RETENTION_DAYS != "":
-            delete(CONFIG.TRANSCRIPTS_FOLDER, CONFIG.TRANSCRIPT_RETENTION_DAYS)
+            for name in delete(CONFIG.TRANSCRIPTS_FOLDER, CONFIG.TRANSCRIPT_RETENTION_DAYS):
+                self.transcribeEngine.transcriptStore.delete(name)
 
         if CONFIG.RECORDING_RETENTION_DAYS != "":
             delete(CONFIG.RECORDINGS_FOLDER, CONFIG.RECORDING_RETENTION_DAYS)
@@ -0,0 +1,297 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module transcribes a saved recording again after the session. The recording is
+# split at silences and the segments are transcribed concurrently by a pool of workers,
+# each with its own recognizer. The results are put back in order in a new transcript.
+# Segments transcribed before with the same service and settings come from the result cache.
+#
+# It can also be run from the command line:
+#   python -m speakreader.batchTranscribe recordings/Transcript-2020-01-01-1000.wav --service vosk
+
+import argparse
+import asyncio
+import math
+import os
+import threading
+import time
+import wave
+
+import numpy as np
+
+import speakreader
+from speakreader import logger
+from speakreader.resultCache import ResultCache, RESULT_CACHE_FILENAME
+
+# The recording is measured in windows of this many seconds.
+WINDOW_SECS = 0.03
+
+# Silences shorter than this do not split the recording.
+MIN_SILENCE_SECS = 0.5
+
+# Segments are at least this long, unless the recording is shorter.
+MIN_SEGMENT_SECS = 5
+
+# Segments are split at the quietest point before this length. The non-streaming
+# APIs take up to a minute of audio.
+MAX_SEGMENT_SECS = 50
+
+# A window is silent if it is quieter than this multiple of the noise floor, and than
+# SILENCE_DBFS. The noise floor of a recording with little silence is the level of speech
+# or of the background noise, so SILENCE_DBFS keeps that from being taken for silence.
+SILENCE_FACTOR = 2.0
+SILENCE_DBFS = -50
+
+BATCH_SUFFIX = "-batch"
+
+
+def readRecording(filename):
+    """ Returns the samples and the sample rate of a 16 bit mono WAV file. """
+    with wave.open(filename, 'rb') as w:
+        if w.getsampwidth() != 2 or w.getnchannels() != 1:
+            raise ValueError("%s is not a 16 bit mono recording" % filename)
+        sample_rate = w.getframerate()
+        samples = np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16)
+    return samples, sample_rate
+
+
+def splitAtSilences(samples, sample_rate):
+    """ Returns the (start, end, silent) sample ranges of the segments of the recording. """
+    window = int(sample_rate * WINDOW_SECS)
+    count = len(samples) // window
+    if count == 0:
+        return [(0, len(samples), False)] if len(samples) else []
+
+    frames = samples[:count * window].astype(np.float32).reshape(count, window)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    ceiling = 32768 * 10 ** (SILENCE_DBFS / 20)
+    threshold = max(min(float(np.percentile(rms, 10)) * SILENCE_FACTOR, ceiling), 1.0)
+    silent = rms <= threshold
+
+    min_silence = math.ceil(MIN_SILENCE_SECS / WINDOW_SECS)
+    min_segment = int(MIN_SEGMENT_SECS / WINDOW_SECS)
+    max_segment = int(MAX_SEGMENT_SECS / WINDOW_SECS)
+
+    # Cut in the middle of every silence that is long enough.
+    cuts = []
+    run = 0
+    for i, quiet in enumerate(silent):
+        if quiet:
+            run += 1
+            continue
+        if run >= min_silence:
+            cuts.append(i - run // 2)
+        run = 0
+    cuts.append(count)
+
+    boundaries = [0]
+    for cut in cuts:
+        while cut - boundaries[-1] > max_segment:
+            low = boundaries[-1] + min_segment
+            high = boundaries[-1] + max_segment
+            boundaries.append(low + int(np.argmin(rms[low:high])))
+        if cut - boundaries[-1] >= min_segment or (cut == count and cut > boundaries[-1]):
+            boundaries.append(cut)
+
+    segments = []
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        last = end == count
+        segments.append((start * window, len(samples) if last else end * window, bool(silent[start:end].all())))
+    return segments
+
+
+class BatchJob(object):
+    """ Transcribes one recording with a pool of workers. """
+
+    def __init__(self, recording, output, serviceClass, workers, cache=None):
+        self.recording = recording
+        self.output = output
+        self.serviceClass = serviceClass
+        self.workers = max(1, int(workers))
+        self.cache = cache
+        self.state = 'queued'
+        self.error = None
+        self.segments = 0
+        self.done = 0
+        self.failed = 0
+        self.cached = 0
+        self.audio_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(name='BatchTranscribe', target=self.run)
+        self._thread.start()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.transcribe())
+        except Exception as e:
+            logger.error("BatchTranscribe: %s failed: %s" % (os.path.basename(self.recording), e))
+            self.state = 'failed'
+            self.error = str(e)
+        finally:
+            self.finished = time.monotonic()
+            loop.close()
+
+    async def transcribe(self):
+        self.state = 'running'
+        self.started = time.monotonic()
+        loop = asyncio.get_event_loop()
+
+        samples, sample_rate = await loop.run_in_executor(None, readRecording, self.recording)
+        segments = splitAtSilences(samples, sample_rate)
+        self.segments = len(segments)
+        self.audio_seconds = len(samples) / sample_rate
+        silent = sum(end - start for start, end, quiet in segments if quiet) / sample_rate
+        logger.info("BatchTranscribe: %s split into %d segments for %d workers, skipping %.1f seconds of silence"
+                    % (os.path.basename(self.recording), self.segments, self.workers, silent))
+
+        queue = asyncio.Queue()
+        for index, segment in enumerate(segments):
+            queue.put_nowait((index, segment))
+        results = [''] * len(segments)
+
+        workers = min(self.workers, len(segments)) or 1
+        recognizers = await asyncio.gather(*[self.createRecognizer(sample_rate) for i in range(workers)])
+        await asyncio.gather(*[self.worker(recognizer, samples, sample_rate, queue, results) for recognizer in recognizers])
+
+        speech = sum(1 for start, end, quiet in segments if not quiet)
+        if speech and self.failed == speech:
+            raise RuntimeError("All %d segments with speech failed" % speech)
+
+        text = ''.join(transcript + "\n\n" for transcript in results if transcript)
+        with open(self.output, 'w') as f:
+            f.write(text)
+
+        if self.failed:
+            # The transcript is written without the segments that failed.
+            self.state = 'partial'
+            logger.warn("BatchTranscribe: %d of %d segments with speech failed and are missing from %s"
+                        % (self.failed, speech, os.path.basename(self.output)))
+            return
+        self.state = 'done'
+        logger.info("BatchTranscribe: %s transcribed to %s in %.1f seconds"
+                    % (os.path.basename(self.recording), os.path.basename(self.output), time.monotonic() - self.started))
+
+    async def createRecognizer(self, sample_rate):
+        recognizer = await asyncio.get_event_loop().run_in_executor(None, self.serviceClass, sample_rate)
+        # The async clients are created on the loop of this job, which warmup() runs on.
+        await recognizer.warmup()
+        return recognizer
+
+    async def worker(self, recognizer, samples, sample_rate, queue, results):
+        while not queue.empty():
+            index, (start, end, silent) = queue.get_nowait()
+            if not silent:
+                try:
+                    results[index] = await self.transcribeSegment(recognizer, samples[start:end].tobytes(), sample_rate)
+                except Exception as e:
+                    logger.warn("BatchTranscribe: Segment %d failed: %s" % (index, e))
+                    self.failed += 1
+            self.done += 1
+
+    async def transcribeSegment(self, recognizer, content, sample_rate):
+        """ Returns the cached transcript of the segment if it was transcribed before with the same settings. """
+        if self.cache is None or not recognizer.is_deterministic:
+            return await recognizer.transcribe(content)
+        key = self.cache.key(content, sample_rate, recognizer)
+        transcript = self.cache.get(key)
+        if transcript is not None:
+            self.cached += 1
+            return transcript
+        transcript = await recognizer.transcribe(content)
+        self.cache.put(key, transcript)
+        return transcript
+
+    def getStatus(self):
+        end = self.finished or time.monotonic()
+        elapsed = end - self.started if self.started else 0.0
+        return {
+            'recording': os.path.basename(self.recording),
+            'output': os.path.basename(self.output),
+            'state': self.state,
+            'error': self.error,
+            'workers': self.workers,
+            'segments': self.segments,
+            'done': self.done,
+            'failed': self.failed,
+            'cached': self.cached,
+            'elapsed': round(elapsed, 1),
+            # Seconds of audio transcribed per second.
+            'speed': round(self.audio_seconds * self.done / self.segments / elapsed, 2) if self.segments and elapsed else 0.0,
+        }
+
+
+def outputFilename(recording):
+    """ Returns the transcript a recording is transcribed to. """
+    name = os.path.splitext(os.path.basename(recording))[0]
+    return os.path.join(speakreader.CONFIG.TRANSCRIPTS_FOLDER, name + BATCH_SUFFIX + ".txt")
+
+
+def main():
+    from speakreader import config
+    from speakreader.transcribeEngine import recognizerClass
+
+    parser = argparse.ArgumentParser(description='Transcribe a saved SpeakReader recording again.')
+    parser.add_argument('recording', help='The WAV recording to transcribe')
+    parser.add_argument('--service', help='The Speech-To-Text Service to use. Defaults to the configured service')
+    parser.add_argument('--workers', type=int, help='The number of segments transcribed at once')
+    parser.add_argument('--output', help='The transcript file to write')
+    parser.add_argument('--config', help='The config file to use',
+                        default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', config.FILENAME))
+    parser.add_argument('-v', '--verbose', action='store_true', help='Increase console logging verbosity')
+    args = parser.parse_args()
+
+    logger.initLogger(console=True, log_dir=False, verbose=args.verbose)
+    speakreader.CONFIG = config.Config(args.config)
+
+    service = args.service or speakreader.CONFIG.SPEECH_TO_TEXT_SERVICE
+    serviceClass = recognizerClass(service)
+    if serviceClass is None:
+        raise SystemExit("The %s Speech-To-Text Service is not supported." % service)
+
+    cache = None
+    if speakreader.CONFIG.RESULT_CACHE_MB > 0:
+        cache = ResultCache(os.path.join(os.path.dirname(os.path.abspath(args.config)), RESULT_CACHE_FILENAME),
+                            speakreader.CONFIG.RESULT_CACHE_MB * 1024 * 1024)
+
+    job = BatchJob(args.recording, args.output or outputFilename(args.recording), serviceClass,
+                   args.workers or speakreader.CONFIG.BATCH_WORKERS, cache)
+    job.start()
+    while job.is_running:
+        job.join(timeout=5)
+        status = job.getStatus()
+        logger.info("BatchTranscribe: %d of %d segments done" % (status['done'], status['segments']))
+    if cache is not None:
+        logger.info("BatchTranscribe: %d of %d segments were cached" % (job.cached, job.segments))
+        cache.close()
+    if job.state != 'done' or job.failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
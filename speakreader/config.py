@@ -31,6 +31,16 @@ def bool_int(value):
     return int(bool(value))
 
 
+def comma_list(value):
+    """
+    Casts a config value into a list of non-empty strings. ConfigObj returns a value
+    written by hand without a comma, like es-ES, as a string rather than a list.
+    """
+    if isinstance(value, str):
+        value = value.split(',')
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
 FILENAME = "config.ini"
 
 _CONFIG_DEFINITIONS = {
@@ -38,22 +48,43 @@ _CONFIG_DEFINITIONS = {
     'LAUNCH_BROWSER': (int, 'General', 1),
     'START_TRANSCRIBE_ON_STARTUP': (int, 'General', 1),
     'SHOW_INTERIM_RESULTS': (int, 'General', 1),
+    'TRANSCRIPT_LANGUAGE': (str, 'General', 'en-US'),
+    'CAPTION_LANGUAGES': (comma_list, 'General', ''),
     'TRANSCRIPTS_FOLDER': (str, 'General', ''),
     'TRANSCRIPT_RETENTION_DAYS': (str, 'General', '30'),
     'ENABLE_CENSORSHIP': (int, 'General', 1),
     'CENSORED_WORDS': (list, 'General', ''),
+    'ALERT_KEYWORDS': (list, 'General', ''),
     'LOG_DIR': (str, 'General', ''),
     'LOG_RETENTION_DAYS': (str, 'General', '30'),
     'ANON_REDIRECT': (str, 'General', 'http://www.nullrefer.com/?'),
     'SERVER_ENVIRONMENT': (str, 'Advanced', 'production'),
+    'FAKE_SCRIPT_FILE': (str, 'Advanced', ''),
+    'TRANSCRIPT_RULES_FILE': (str, 'Advanced', ''),
+    'FORMAT_NUMBERS': (int, 'Advanced', 0),
+    'FAKE_LATENCY_MS': (int, 'Advanced', 300),
+    'FAKE_JITTER_MS': (int, 'Advanced', 100),
+    'FAKE_ERRORS_PER_MINUTE': (float, 'Advanced', 0),
+    'FAKE_ERROR_MODE': (str, 'Advanced', 'reset'),
+    'BATCH_WORKERS': (int, 'Advanced', 4),
+    'RESULT_CACHE_MB': (int, 'Advanced', 50),
+    'TRANSCRIPT_SYNC_SECS': (float, 'Advanced', 2.0),
+    'ALERT_WEBHOOK_URL': (str, 'Advanced', ''),
+    'ALERT_PIPE': (str, 'Advanced', ''),
+    'ALERT_UDP_ADDRESS': (str, 'Advanced', ''),
+    'TRANSCRIPT_WEBHOOK_URL': (str, 'Advanced', ''),
+    'TRANSCRIPT_PIPE': (str, 'Advanced', ''),
+    'TRANSCRIPT_UDP_ADDRESS': (str, 'Advanced', ''),
     'SAVE_RECORDINGS': (int, 'General', 1),
     'RECORDINGS_FOLDER': (str, 'General', ''),
     'RECORDING_RETENTION_DAYS': (str, 'General', '30'),
     'SPEECH_TO_TEXT_SERVICE': (str, 'General', 'google'),
+    'SPEECH_TO_TEXT_STANDBY_SERVICE': (str, 'General', ''),
     'GOOGLE_CREDENTIALS_FILE': (str, 'General', ''),
     'IBM_CREDENTIALS_FILE': (str, 'General', ''),
     'MICROSOFT_SERVICE_APIKEY': (str, 'General', ''),
     'MICROSOFT_SERVICE_REGION': (str, 'General', 'eastus'),
+    'VOSK_MODEL_PATH': (str, 'General', ''),
 
     'HTTP_PORT': (int, 'HTTP', 8880),
     'ENABLE_HTTPS': (int, 'HTTP', 0),
@@ -0,0 +1,155 @@
+import asyncio
+import random
+import time
+
+import speakreader
+from speakreader import logger
+from speakreader.recognizer import Recognizer, RecognizerError, RecognitionResult
+
+# A stand-in speech-to-text service for load and latency testing without a network
+# connection or cloud charges. It paces scripted text against the audio it receives and
+# can delay, jitter and break the stream the way the real services do.
+
+is_supported = True
+
+# Speaking rate used to pace the script against the audio.
+WORDS_PER_SECOND = 2.5
+
+# An interim result is sent every this many words.
+INTERIM_EVERY_WORDS = 2
+
+DEFAULT_SCRIPT = [
+    "Welcome to SpeakReader.",
+    "This transcript is produced by the test speech service and does not come from the microphone.",
+    "Each line of the script is sent as interim results while it is being spoken and then as a final result.",
+    "The latency, jitter and error settings can be changed in the configuration file.",
+]
+
+# Error modes, named after the failures of the real services.
+ERROR_RESET = 'reset'    # Google ends the stream (OutOfRange). The utterance in progress is lost.
+ERROR_CLOSE = 'close'    # IBM closes the websocket after sending what it has.
+ERROR_CANCEL = 'cancel'  # Azure cancels the session. The engine stops.
+
+
+class fakeTranscribe(Recognizer):
+
+    name = 'fake'
+    # The transcript follows the script, not the audio.
+    is_deterministic = False
+
+    def __init__(self, sample_rate, language=None):
+        super().__init__(sample_rate, language)
+        self.is_supported = is_supported
+
+        self.latency = speakreader.CONFIG.FAKE_LATENCY_MS / 1000
+        self.jitter = speakreader.CONFIG.FAKE_JITTER_MS / 1000
+        self.errors_per_minute = speakreader.CONFIG.FAKE_ERRORS_PER_MINUTE
+        self.error_mode = speakreader.CONFIG.FAKE_ERROR_MODE
+
+        self.script = self.loadScript(speakreader.CONFIG.FAKE_SCRIPT_FILE)
+        self._line = 0
+        self._random = random.Random()
+
+    @staticmethod
+    def configKey():
+        return (speakreader.CONFIG.FAKE_SCRIPT_FILE, speakreader.CONFIG.FAKE_LATENCY_MS, speakreader.CONFIG.FAKE_JITTER_MS,
+                speakreader.CONFIG.FAKE_ERRORS_PER_MINUTE, speakreader.CONFIG.FAKE_ERROR_MODE)
+
+    @staticmethod
+    def loadScript(filename):
+        if not filename:
+            return [line.split() for line in DEFAULT_SCRIPT]
+        with open(filename) as f:
+            script = [line.split() for line in f.read().splitlines() if line.strip()]
+        if not script:
+            logger.warn("fakeTranscribe: Script file %s is empty. Using the default script." % filename)
+            return [line.split() for line in DEFAULT_SCRIPT]
+        return script
+
+    async def recognize(self, audio):
+        # Async generator to return transcription results
+        logger.debug("fakeTranscribe.recognize ENTER")
+
+        loop = asyncio.get_event_loop()
+        self.startStream(audio)
+        results = asyncio.Queue()
+        producer = asyncio.ensure_future(self.produce(audio, results))
+
+        try:
+            while True:
+                deliver_at, response = await results.get()
+                delay = deliver_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if response is None:
+                    break
+                if isinstance(response, Exception):
+                    raise response
+                # The result arrives now, after the simulated latency.
+                response.received = time.monotonic()
+                yield response
+        finally:
+            producer.cancel()
+
+        logger.debug("fakeTranscribe.recognize EXIT")
+
+    async def produce(self, audio, results):
+        """ Paces the script against the audio and queues the results with their delivery time. """
+        loop = asyncio.get_event_loop()
+        last_delivery = 0.0
+        audio_seconds = 0.0
+        spoken = 0
+        words = self.script[self._line]
+        # Sample clock positions of the start of the line and the end of each word spoken.
+        ends = [audio.position]
+
+        def final(count):
+            timed = [(word, ends[i], ends[i + 1]) for i, word in enumerate(words[:count])]
+            return self.result(' '.join(words[:count]), True, words=timed)
+
+        def deliver(response):
+            nonlocal last_delivery
+            if isinstance(response, RecognitionResult):
+                # The words end with the audio read so far.
+                response.audio_end = audio.position
+            # Results keep their order no matter how much jitter is applied.
+            deliver_at = loop.time() + max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            last_delivery = max(last_delivery, deliver_at)
+            results.put_nowait((last_delivery, response))
+
+        async for content in audio:
+            seconds = len(content) / self._bytes_per_second
+            audio_seconds += seconds
+
+            if self.errors_per_minute > 0 and self._random.random() < self.errors_per_minute * seconds / 60:
+                logger.debug("fakeTranscribe: Injecting %s error" % self.error_mode)
+                if self.error_mode == ERROR_CANCEL:
+                    deliver(RecognizerError('fakeTranscribe canceled by the test speech service'))
+                    return
+                if self.error_mode == ERROR_CLOSE and spoken:
+                    deliver(final(spoken))
+                    self.nextLine()
+                deliver(None)
+                return
+
+            while spoken < min(len(words), int(audio_seconds * WORDS_PER_SECOND)):
+                spoken += 1
+                ends.append(audio.position)
+                if spoken == len(words):
+                    deliver(final(spoken))
+                    self.nextLine()
+                    words = self.script[self._line]
+                    ends = [audio.position]
+                    audio_seconds = 0.0
+                    spoken = 0
+                    break
+                if spoken % INTERIM_EVERY_WORDS == 0 and speakreader.CONFIG.SHOW_INTERIM_RESULTS:
+                    deliver(self.result(' '.join(words[:spoken]), False))
+
+        if spoken:
+            deliver(final(spoken))
+            self.nextLine()
+        deliver(None)
+
+    def nextLine(self):
+        self._line = (self._line + 1) % len(self.script)
@@ -1,36 +1,49 @@
-from queue import Queue
+import asyncio
 
 import speakreader
 from speakreader import logger
+from speakreader.recognizer import Recognizer
 
 try:
     from google.cloud import speech
     from google.api_core import exceptions
+    from google.oauth2 import service_account
+    from google.auth.transport.requests import Request
     is_supported = True
 except ImportError:
     is_supported = False
 
-class googleTranscribe:
+# Google Cloud ends a streaming session after about 5 minutes of audio. Instead of waiting
+# for the service to cut the stream, the next session is opened before the limit and both
+# sessions are fed the same audio for a short overlap.
+STREAM_ROLLOVER_SECS = 280
+STREAM_OVERLAP_SECS = 5
 
-    def __init__(self, audio_device):
+AUTH_SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+
+class googleTranscribe(Recognizer):
+
+    name = 'google'
+
+    def __init__(self, sample_rate, language=None):
+        super().__init__(sample_rate, language)
         self.is_supported = is_supported
         if not self.is_supported:
             return
 
-        self.audio_device = audio_device
-
-        self.responseQueue = Queue(maxsize=100)
-
         self.credentials_json = speakreader.CONFIG.GOOGLE_CREDENTIALS_FILE
 
-        self.client = speech.SpeechClient.from_service_account_json(self.credentials_json)
+        self.credentials = service_account.Credentials.from_service_account_file(self.credentials_json, scopes=AUTH_SCOPES)
+        self._client = None
 
         self.recognition_config = speech.RecognitionConfig(
             encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=audio_device._outputSampleRate,
-            language_code="en-US",
+            sample_rate_hertz=self.sample_rate,
+            language_code=self.language,
             max_alternatives=1,
-            enable_word_time_offsets=False,
+            # Word offsets are used to stitch the results of overlapping sessions and are stored with the transcript.
+            enable_word_time_offsets=True,
             enable_automatic_punctuation=True,
             profanity_filter=bool(speakreader.CONFIG.ENABLE_CENSORSHIP),
         )
@@ -40,51 +53,216 @@ class googleTranscribe:
             interim_results=True,
         )
 
-    def transcribe(self):
-        # Generator to return transcription results
+        self._committed_end = 0.0
 
+    @property
+    def client(self):
+        # The channel of the client is bound to the event loop it is created on, so it is created
+        # on first use from the loop rather than with the recognizer, which may be in a worker thread.
+        if self._client is None:
+            self._client = speech.SpeechAsyncClient(credentials=self.credentials)
+        return self._client
+
+    @staticmethod
+    def configKey():
+        return (speakreader.CONFIG.GOOGLE_CREDENTIALS_FILE, speakreader.CONFIG.ENABLE_CENSORSHIP)
+
+    async def warmup(self):
         if not self.is_supported:
             return
+        # Fetch the access token now rather than on the first request.
+        await asyncio.get_event_loop().run_in_executor(None, self.credentials.refresh, Request())
+        # Creates the client, on the loop of the engine.
+        self.client
 
-        logger.debug("googleTranscribe.transcribe ENTER")
+    async def transcribe(self, content):
+        if not self.is_supported:
+            return ''
+        # The non-streaming API takes up to a minute of audio.
+        response = await self.client.recognize(config=self.recognition_config,
+                                               audio=speech.RecognitionAudio(content=content))
+        return ' '.join(result.alternatives[0].transcript.strip() for result in response.results if result.alternatives)
 
-        while True:
-            audio_generator = self.audio_device.streamGenerator()
+    async def recognize(self, audio):
+        # Async generator to return transcription results
 
-            requests = (speech.StreamingRecognizeRequest(
-                    audio_content = content,
-                )
-                for content in audio_generator
-            )
+        if not self.is_supported:
+            return
+
+        logger.debug("googleTranscribe.recognize ENTER")
+
+        self.startStream(audio)
+        self._committed_end = 0.0
+        responses = asyncio.Queue()
+
+        feeder = asyncio.ensure_future(self.feedAudio(audio, responses))
+
+        # Only the oldest running session publishes. Finals from the next session are held
+        # until the previous one has delivered its last result, then trimmed and replayed.
+        publishing = 0
+        ended = set()
+        held = {}
 
-            responses = self.client.streaming_recognize(requests=requests, config=self.streaming_config)
+        try:
+            while True:
+                item = await responses.get()
+                if item is None:
+                    break
 
-            try:
-                for response in responses:
-                    if not response.results:
-                        continue
+                session, response = item
 
-                    result = response.results[0]
+                if response is None:
+                    if session.error is not None:
+                        raise session.error
+                    ended.add(session.index)
+                    while publishing in ended:
+                        publishing += 1
+                        for held_session, held_result in held.pop(publishing, []):
+                            transcript = self.stitch(held_session, held_result)
+                            if transcript is not None:
+                                yield transcript
+                    continue
 
-                    if not result.is_final and not speakreader.CONFIG.SHOW_INTERIM_RESULTS:
-                        continue
+                if not response.results:
+                    continue
 
-                    if not result.alternatives:
-                        continue
+                result = response.results[0]
 
-                    transcript = {
-                        'transcript': result.alternatives[0].transcript,
-                        'is_final': result.is_final,
-                    }
+                if not result.is_final and not speakreader.CONFIG.SHOW_INTERIM_RESULTS:
+                    continue
 
+                if not result.alternatives:
+                    continue
+
+                if session.index > publishing:
+                    if result.is_final:
+                        held.setdefault(session.index, []).append((session, result))
+                    continue
+
+                transcript = self.stitch(session, result)
+                if transcript is not None:
                     yield transcript
 
-                logger.debug("googleTranscribe.transcribe EXIT")
-                break
+        finally:
+            feeder.cancel()
+
+        logger.debug("googleTranscribe.recognize EXIT")
+
+    def stitch(self, session, result):
+        """ Drop the words of a result that were already published by the previous session. """
+        result_end = session.start_offset + result.result_end_time.total_seconds()
+        if result_end <= self._committed_end:
+            return None
+
+        alternative = result.alternatives[0]
+        text = alternative.transcript
+        # The word offsets are from the start of the session.
+        words = [(word.word, session.start_offset + word.start_time.total_seconds(),
+                  session.start_offset + word.end_time.total_seconds()) for word in alternative.words]
+
+        if session.start_offset < self._committed_end and words:
+            words = [word for word in words if (word[1] + word[2]) / 2 > self._committed_end]
+            if not words:
+                return None
+            text = ' '.join(word for word, start, end in words)
+
+        if result.is_final:
+            self._committed_end = result_end
+
+        return self.result(text, result.is_final, audio_end=self.streamPosition(result_end),
+                           words=self.wordTimes(words) if result.is_final and words else None)
+
+    async def feedAudio(self, audio, responses):
+        """ Copy the audio to the running sessions and roll them over before the limit. """
+        logger.debug("googleTranscribe.feedAudio ENTER")
+        sessions = []
+        live = []
+        position = 0.0
+
+        try:
+            async for content in audio:
+                live = [session for session in live if not session.done]
+
+                if not live:
+                    live.append(self.startSession(len(sessions), position, responses))
+                    sessions.append(live[-1])
+                elif len(live) == 1 and live[0].duration >= STREAM_ROLLOVER_SECS:
+                    logger.debug("googleTranscribe.feedAudio rolling over to session %d" % len(sessions))
+                    live.append(self.startSession(len(sessions), position, responses))
+                    sessions.append(live[-1])
+
+                if len(live) > 1 and live[-1].duration >= STREAM_OVERLAP_SECS:
+                    for session in live[:-1]:
+                        session.close()
+                    live = live[-1:]
+
+                seconds = len(content) / self._bytes_per_second
+                for session in live:
+                    session.put(content, seconds)
+                position += seconds
+
+            for session in live:
+                session.close()
+            await asyncio.gather(*[session.task for session in sessions])
+            await responses.put(None)
+
+        except asyncio.CancelledError:
+            for session in sessions:
+                session.task.cancel()
+            raise
+
+        logger.debug("googleTranscribe.feedAudio EXIT")
+
+    def startSession(self, index, position, responses):
+        session = RecognizeSession(self, index, position, responses)
+        session.task = asyncio.ensure_future(session.run())
+        return session
+
+
+class RecognizeSession(object):
+    """ A single streaming_recognize call fed from its own audio queue. """
+
+    def __init__(self, transcriber, index, start_offset, responses):
+        self.transcriber = transcriber
+        self.index = index
+        self.start_offset = start_offset
+        self.duration = 0.0
+        self.done = False
+        self.error = None
+        self.task = None
+        self._responses = responses
+        self._audioQueue = asyncio.Queue()
+
+    def put(self, content, seconds):
+        self._audioQueue.put_nowait(content)
+        self.duration += seconds
+
+    def close(self):
+        self._audioQueue.put_nowait(None)
+
+    async def requests(self):
+        yield speech.StreamingRecognizeRequest(streaming_config=self.transcriber.streaming_config)
+        while True:
+            content = await self._audioQueue.get()
+            if content is None:
+                return
+            yield speech.StreamingRecognizeRequest(audio_content=content)
+
+    async def run(self):
+        try:
+            responses = await self.transcriber.client.streaming_recognize(requests=self.requests())
+            async for response in responses:
+                await self._responses.put((self, response))
+        except exceptions.OutOfRange:
+            """ Google Cloud limits stream to about 5 minutes. The feeder starts a new session. """
+            pass
+        except exceptions.DeadlineExceeded:
+            """ Google Cloud limits stream to about 5 minutes. The feeder starts a new session. """
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = e
 
-            except exceptions.OutOfRange:
-                """ Google Cloud limits stream to about 5 minutes. Just loop. """
-                continue
-            except exceptions.DeadlineExceeded:
-                """ Google Cloud limits stream to about 5 minutes. Just loop. """
-                continue
+        self.done = True
+        await self._responses.put((self, None))
@@ -0,0 +1,272 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module runs a primary and a standby speech-to-text service on the same audio and
+# publishes the results of whichever one is healthier. A circuit breaker per service
+# keeps the published transcript from flapping between them.
+
+import asyncio
+import collections
+import time
+
+import speakreader
+from speakreader import logger
+from speakreader.recognizer import Recognizer, AudioTee
+
+# Seconds over which errors and result lag are tracked.
+HEALTH_WINDOW_SECS = 60
+
+# A service is failing if it has not returned a result for this many seconds of the audio it
+# was fed, while the other service returned results for that audio.
+STALL_SECS = 5
+
+# The same without interim results, when a healthy service returns nothing until the end of
+# an utterance and may trail the other service by a whole sentence.
+FINAL_STALL_SECS = 30
+
+# Failures within the window that open the circuit breaker.
+FAILURE_THRESHOLD = 2
+
+# Seconds an open breaker waits before letting the service prove itself again.
+RESET_TIMEOUT_SECS = 30
+
+# Seconds the primary must stay healthy before the transcript switches back to it.
+RECOVERY_SECS = 60
+
+# Seconds to wait before restarting a service that ended with an error.
+RESTART_DELAY_SECS = 2
+
+
+class CircuitBreaker(object):
+    """ Tracks the failures of a service. Open means the service should not be used. """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name):
+        self.name = name
+        self._state = self.CLOSED
+        self._failures = collections.deque()
+        self._opened_at = 0.0
+        self.closed_since = time.monotonic()
+
+    @property
+    def state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= RESET_TIMEOUT_SECS:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def record_failure(self):
+        now = time.monotonic()
+        self._failures.append(now)
+        while self._failures and now - self._failures[0] > HEALTH_WINDOW_SECS:
+            self._failures.popleft()
+
+        if self.state == self.HALF_OPEN or len(self._failures) >= FAILURE_THRESHOLD:
+            if self._state != self.OPEN:
+                logger.warn("HedgedRecognizer: %s circuit breaker opened" % self.name)
+            self._state = self.OPEN
+            self._opened_at = now
+
+    def record_success(self):
+        if self.state == self.HALF_OPEN:
+            logger.info("HedgedRecognizer: %s circuit breaker closed" % self.name)
+            self._state = self.CLOSED
+            self._failures.clear()
+            self.closed_since = time.monotonic()
+
+
+class ProviderHealth(object):
+    """ Rolling result lag and error count of one service. """
+
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+        self.name = recognizer.name
+        self.breaker = CircuitBreaker(recognizer.name)
+        # The audio the service is fed, and the sample clock position of the end of its last result.
+        self.audio = None
+        self.audio_end = None
+        self.last_stall = 0
+        self.errors = collections.deque()
+        self.lags = collections.deque()
+
+    def start(self, audio):
+        self.audio = audio
+        if self.audio_end is None:
+            self.audio_end = audio.position
+
+    def record_result(self, response):
+        audio_end = response.audio_end
+        if audio_end is None and self.audio is not None:
+            # A service that does not tell where its results end is taken to be up to date.
+            audio_end = self.audio.position
+        if audio_end is not None:
+            self.audio_end = max(self.audio_end or 0, audio_end)
+            if self.audio is not None:
+                # How far the results trail the audio the service was fed.
+                self.record_lag(max(0, self.audio.position - audio_end) / self.recognizer.sample_rate)
+        self.breaker.record_success()
+
+    def record_error(self):
+        now = time.monotonic()
+        self.errors.append(now)
+        self._expire(self.errors, now)
+        self.breaker.record_failure()
+
+    def record_lag(self, lag, now=None):
+        now = now or time.monotonic()
+        self.lags.append((now, lag))
+        while self.lags and now - self.lags[0][0] > HEALTH_WINDOW_SECS:
+            self.lags.popleft()
+
+    def check_stall(self, peer):
+        """
+        Counts a failure for every STALL_SECS of audio this service was fed and has not returned a
+        result for, while its peer returned results for that audio. Without interim results a
+        healthy service returns nothing until the end of an utterance, so FINAL_STALL_SECS is used.
+        """
+        if self.audio is None or self.audio_end is None or peer.audio_end is None:
+            return
+        stallSecs = STALL_SECS if speakreader.CONFIG.SHOW_INTERIM_RESULTS else FINAL_STALL_SECS
+        stall = stallSecs * self.recognizer.sample_rate
+        behind = min(self.audio.position, peer.audio_end) - self.audio_end
+        if behind > stall and peer.audio_end - max(self.last_stall, self.audio_end) > stall:
+            logger.warn("HedgedRecognizer: %s has not returned a result for %.1f seconds of audio"
+                        % (self.name, behind / self.recognizer.sample_rate))
+            self.last_stall = peer.audio_end
+            self.breaker.record_failure()
+
+    @staticmethod
+    def _expire(events, now):
+        while events and now - events[0] > HEALTH_WINDOW_SECS:
+            events.popleft()
+
+    def getStatus(self):
+        now = time.monotonic()
+        self._expire(self.errors, now)
+        lags = [lag for t, lag in self.lags]
+        return {
+            'breaker': self.breaker.state,
+            'errors': len(self.errors),
+            # Seconds the results trail the audio fed to the service, on average.
+            'result_lag': round(sum(lags) / len(lags), 3) if lags else 0.0,
+        }
+
+
+class HedgedRecognizer(Recognizer):
+    """ Sends the audio to a primary and a standby service and publishes the healthier one. """
+
+    def __init__(self, primary, standby, latencyMonitor=None):
+        super().__init__(primary.sample_rate)
+        # The engine measures the results it publishes. The results of the other service are measured here.
+        self.latencyMonitor = latencyMonitor
+        self.is_supported = True
+        self.primary = ProviderHealth(primary)
+        self.standby = ProviderHealth(standby)
+        self.active = self.primary
+        self.name = primary.name
+
+    async def warmup(self):
+        await asyncio.gather(self.primary.recognizer.warmup(), self.standby.recognizer.warmup())
+
+    async def recognize(self, audio):
+        logger.debug("HedgedRecognizer.recognize ENTER")
+
+        tee = AudioTee(audio, 2)
+        results = asyncio.Queue()
+        tasks = [
+            asyncio.ensure_future(self.run(self.primary, tee.outputs[0], results)),
+            asyncio.ensure_future(self.run(self.standby, tee.outputs[1], results)),
+        ]
+
+        try:
+            running = len(tasks)
+            while running:
+                provider, response = await results.get()
+                if response is None:
+                    running -= 1
+                    continue
+
+                provider.record_result(response)
+                peer = self.standby if provider is self.primary else self.primary
+                peer.check_stall(provider)
+                self.selectActive()
+
+                if provider is self.active:
+                    yield response
+                elif self.latencyMonitor is not None:
+                    self.latencyMonitor.recordResult(response, audio.clock)
+        finally:
+            tee.close()
+            for task in tasks:
+                task.cancel()
+
+        logger.debug("HedgedRecognizer.recognize EXIT")
+
+    async def run(self, provider, audio, results):
+        """ Runs one service until its audio ends, restarting it after errors. """
+        provider.start(audio)
+        while not audio.closed:
+            received = False
+            try:
+                async for response in provider.recognizer.recognize(audio):
+                    received = True
+                    await results.put((provider, response))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warn("HedgedRecognizer: %s failed: %s" % (provider.name, e))
+                provider.record_error()
+                self.selectActive()
+                received = False
+            else:
+                if not received and not audio.closed:
+                    # The service closed the stream without a result, as when the connection is refused.
+                    logger.warn("HedgedRecognizer: %s ended without a result" % provider.name)
+                    provider.record_error()
+                    self.selectActive()
+            if not received and not audio.closed:
+                await asyncio.sleep(RESTART_DELAY_SECS)
+        await results.put((provider, None))
+
+    def selectActive(self):
+        if self.active is self.primary:
+            if self.primary.breaker.state == CircuitBreaker.OPEN and self.standby.breaker.state != CircuitBreaker.OPEN:
+                self.switch(self.standby)
+        else:
+            breaker = self.primary.breaker
+            if breaker.state == CircuitBreaker.CLOSED and time.monotonic() - breaker.closed_since >= RECOVERY_SECS:
+                self.switch(self.primary)
+            elif self.standby.breaker.state == CircuitBreaker.OPEN and breaker.state != CircuitBreaker.OPEN:
+                self.switch(self.primary)
+
+    def switch(self, provider):
+        logger.warn("HedgedRecognizer: Switching the transcript from %s to %s" % (self.active.name, provider.name))
+        self.active = provider
+        self.name = provider.name
+
+    def getMetrics(self):
+        metrics = self.primary.recognizer.getMetrics()
+        metrics.update(self.standby.recognizer.getMetrics())
+        return metrics
+
+    def getStatus(self):
+        return {
+            'active': self.active.name,
+            self.primary.name: self.primary.getStatus(),
+            self.standby.name: self.standby.getStatus(),
+        }
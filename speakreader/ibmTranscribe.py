@@ -6,11 +6,12 @@
 # recordings to the queue, and the websocket client would be sending the
 # recordings to the speech to text service
 
-from threading import Thread
+import asyncio
 from queue import Queue
 
 import speakreader
 from speakreader import logger
+from speakreader.recognizer import Recognizer, RecognizerError, ResultChannel, pump_audio
 
 try:
     from ibm_watson import SpeechToTextV1
@@ -21,15 +22,16 @@ except ImportError:
     is_supported = False
 
 
-class ibmTranscribe:
+class ibmTranscribe(Recognizer):
 
-    def __init__(self, audio_device):
+    name = 'IBM'
+
+    def __init__(self, sample_rate, language=None):
+        super().__init__(sample_rate, language)
         self.is_supported = is_supported
         if not self.is_supported:
             return
 
-        self.audio_device = audio_device
-
         APIKEY = None
         URL = None
         with open(speakreader.CONFIG.IBM_CREDENTIALS_FILE) as f:
@@ -47,41 +49,92 @@ class ibmTranscribe:
         self.authenticator = IAMAuthenticator(APIKEY)
         self.speech_to_text = SpeechToTextV1(authenticator=self.authenticator)
         self.speech_to_text.set_service_url(URL)
-        self.mycallback = ProcessResponses()
+        self.mycallback = None
+        self.audio_source = None
+        # The broadband models take audio sampled at 16 kHz or more.
+        self.model = '%s_BroadbandModel' % self.language
 
-        self.audio_source = AudioSource(audio_device._streamBuff, is_recording=True, is_buffer=True)
+    @staticmethod
+    def configKey():
+        return (speakreader.CONFIG.IBM_CREDENTIALS_FILE, speakreader.CONFIG.ENABLE_CENSORSHIP)
 
-    def transcribe(self):
+    async def warmup(self):
         if not self.is_supported:
             return
-        # Generator to return transcription results
-        logger.debug('ibmTranscribe.transcribe ENTER')
-
-        recognize_thread = Thread(target=self.recognize_using_websocket, args=())
-        recognize_thread.start()
+        # Fetch the IAM token now rather than when the websocket connects.
+        await asyncio.get_event_loop().run_in_executor(None, self.authenticator.token_manager.get_token)
 
-        while True:
-            response = self.mycallback.responseQueue.get()
-            if response is None:
-                break
-            yield response
+    async def transcribe(self, content):
+        if not self.is_supported:
+            return ''
+        return await asyncio.get_event_loop().run_in_executor(None, self.recognizeOnce, content)
+
+    def recognizeOnce(self, content):
+        response = self.speech_to_text.recognize(
+            audio=content,
+            content_type='audio/l16; rate=%s' % self.sample_rate,
+            model=self.model,
+            smart_formatting=True,
+            profanity_filter=bool(speakreader.CONFIG.ENABLE_CENSORSHIP),
+        ).get_result()
+        return ' '.join(result['alternatives'][0]['transcript'].strip()
+                        for result in response.get('results', []) if result.get('alternatives'))
 
+    async def recognize(self, audio):
+        if not self.is_supported:
+            return
+        # Async generator to return transcription results
+        logger.debug('ibmTranscribe.recognize ENTER')
+
+        loop = asyncio.get_event_loop()
+        self.startStream(audio)
+        self.mycallback = ProcessResponses(self, loop)
+
+        # The websocket client reads the audio from a thread queue.
+        audioQueue = Queue()
+        self.audio_source = AudioSource(audioQueue, is_recording=True, is_buffer=True)
+        pump = asyncio.ensure_future(self.pumpAudio(audio, audioQueue))
+
+        recognize_future = loop.run_in_executor(None, self.recognize_using_websocket)
+
+        try:
+            while True:
+                response = await self.mycallback.get()
+                if response is None:
+                    break
+                if isinstance(response, RecognizerError):
+                    raise response
+                yield response
+        finally:
+            if not pump.done():
+                pump.cancel()
+                self.endRecording(audioQueue)
+            await recognize_future
+
+        logger.debug('ibmTranscribe.recognize EXIT')
+
+    async def pumpAudio(self, audio, audioQueue):
+        await pump_audio(audio, audioQueue)
+        self.endRecording(audioQueue)
+
+    def endRecording(self, audioQueue):
         self.audio_source.completed_recording()
-        recognize_thread.join()
-        logger.debug('ibmTranscribe.transcribe EXIT')
-
+        # Wake the websocket sender so it sees that the recording is complete.
+        audioQueue.put(b'')
 
     # this function will initiate the recognize service and pass in the AudioSource
     def recognize_using_websocket(self, *args):
         logger.debug("ibmTransribe.recognize_using_websocket ENTER")
         self.speech_to_text.recognize_using_websocket(
             audio=self.audio_source,
-            content_type='audio/l16; rate=%s' % self.audio_device._outputSampleRate,
+            content_type='audio/l16; rate=%s' % self.sample_rate,
+            model=self.model,
             recognize_callback=self.mycallback,
             interim_results=True,
             max_alternatives=1,
             inactivity_timeout=-1,
             smart_formatting=True,
+            timestamps=True,
             word_alternatives_threshold=0.75,
             profanity_filter=bool(speakreader.CONFIG.ENABLE_CENSORSHIP),
         )
@@ -89,10 +142,11 @@ class ibmTranscribe:
 
 
 # define callback for the speech to text service
-class ProcessResponses(RecognizeCallback):
-    def __init__(self):
+class ProcessResponses(RecognizeCallback, ResultChannel):
+    def __init__(self, transcriber, loop):
         logger.debug("ibmTranscribe.ProcessResponse.Init ENTER")
-        self.responseQueue = Queue(maxsize=100)
+        self.transcriber = transcriber
+        ResultChannel.__init__(self, loop, transcriber.metrics)
         RecognizeCallback.__init__(self)
 
     def on_connected(self):
@@ -100,6 +154,8 @@ class ProcessResponses(RecognizeCallback):
 
     def on_error(self, error):
         logger.warn('ibmTranscribe.ProcessResponses.Error Error received: {}'.format(error))
+        # Ends the recognition with the error, rather than as if the audio had ended.
+        self.put_threadsafe(RecognizerError('ibmTranscribe error from the Speech to Text service: {}'.format(error)))
 
     def on_inactivity_timeout(self, error):
         logger.debug('ibmTranscribe.ProcessResponses.Inactivity timeout: {}'.format(error))
@@ -121,6 +177,10 @@ class ProcessResponses(RecognizeCallback):
         transcript = data['results'][0]['alternatives'][0]['transcript']
         final = data['results'][0]['final']
 
+        # Each timestamp is [word, start, end] in seconds from the start of the stream.
+        timestamps = data['results'][0]['alternatives'][0].get('timestamps')
+        audio_end = self.transcriber.streamPosition(timestamps[-1][2]) if timestamps else None
+
         if not final and not speakreader.CONFIG.SHOW_INTERIM_RESULTS:
             return
 
@@ -128,13 +188,11 @@ class ProcessResponses(RecognizeCallback):
         if '%HESITATION' in transcript:
             return
 
-        response = {
-            'transcript': transcript,
-            'is_final': final,
-        }
+        words = self.transcriber.wordTimes(timestamps) if final and timestamps else None
+        response = self.transcriber.result(transcript, final, audio_end=audio_end, words=words)
 
-        self.responseQueue.put_nowait(response)
+        self.put_threadsafe(response)
 
     def on_close(self):
-        self.responseQueue.put_nowait(None)
+        self.put_threadsafe(None)
         logger.debug("ibmTranscribe.ProcessResponses.Close Connection closed")
@@ -0,0 +1,76 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module spots the alert keywords of the configuration in the captions as they are
+# recognized. The interim results of an utterance are revisions of the same words, so a
+# keyword is alerted once per occurrence in the utterance: the first revision that has it
+# raises the alert, and later revisions and the final only do when it occurs more often.
+
+import threading
+import time
+
+import speakreader
+from speakreader.wordMatcher import WordMatcher
+
+
+class KeywordSpotter(object):
+    """ Finds the alert keywords in the results of the utterance being recognized. """
+
+    def __init__(self):
+        self._words = ()
+        self._matcher = WordMatcher(())
+        # The spelling of each keyword in the configuration, by its lower case.
+        self._keywords = {}
+        # How often each keyword was alerted in the current utterance.
+        self._alerted = {}
+        self._lock = threading.Lock()
+
+    def matcher(self):
+        words = tuple(speakreader.CONFIG.ALERT_KEYWORDS)
+        if words != self._words:
+            keywords = [word.strip() for word in words if word.strip()]
+            self._matcher = WordMatcher(keywords)
+            self._keywords = {word.lower(): word for word in keywords}
+            self._alerted = {}
+            self._words = words
+        return self._matcher
+
+    def spot(self, transcript, is_final, provider=None):
+        """ Returns the alerts for the keywords in a result not alerted earlier in its utterance. """
+        with self._lock:
+            counts = {}
+            for match in self.matcher().finditer(transcript):
+                keyword = self._keywords.get(match.group().lower(), match.group())
+                counts[keyword] = counts.get(keyword, 0) + 1
+
+            alerts = []
+            now = int(time.time() * 1000)
+            for keyword, count in counts.items():
+                new = count - self._alerted.get(keyword, 0)
+                if new > 0:
+                    self._alerted[keyword] = count
+                    alerts.append({
+                        'event': 'alert',
+                        'keyword': keyword,
+                        'count': new,
+                        'transcript': transcript,
+                        'final': is_final,
+                        'provider': provider,
+                        'time_ms': now,
+                    })
+            if is_final:
+                self._alerted = {}
+            return alerts
@@ -0,0 +1,180 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module measures how long the transcription results take. For each result the
+# provider lag runs from the capture of the end of the matching audio to the arrival of
+# the result, and the pipeline lag from its arrival to its hand-off to the queue manager.
+# The storage lag of a final runs from its hand-off to the transcript writer to its sync
+# to the disk.
+
+import threading
+import time
+
+# Upper bounds of the histogram buckets in seconds. The last bucket is unbounded.
+BUCKETS = (0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+
+# The rolling histograms cover this many seconds, kept in slots of SLOT_SECS.
+WINDOW_SECS = 300
+SLOT_SECS = 60
+
+# The pipeline and storage lags are kept under these provider names.
+PIPELINE = 'pipeline'
+STORAGE = 'storage'
+
+
+class RollingHistogram(object):
+    """ Histogram of the values recorded in the last WINDOW_SECS, plus running totals. """
+
+    def __init__(self):
+        self._slots = []
+        self.total_counts = [0] * (len(BUCKETS) + 1)
+        self.total_sum = 0.0
+        self.total_count = 0
+
+    def record(self, value, now):
+        slot = int(now // SLOT_SECS)
+        if not self._slots or self._slots[-1][0] != slot:
+            self._slots.append([slot, [0] * (len(BUCKETS) + 1), 0.0, 0.0])
+            self._expire(now)
+
+        bucket = self.bucket(value)
+        counts = self._slots[-1][1]
+        counts[bucket] += 1
+        self._slots[-1][2] += value
+        self._slots[-1][3] = max(self._slots[-1][3], value)
+        self.total_counts[bucket] += 1
+        self.total_sum += value
+        self.total_count += 1
+
+    @staticmethod
+    def bucket(value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                return i
+        return len(BUCKETS)
+
+    def _expire(self, now):
+        oldest = int((now - WINDOW_SECS) // SLOT_SECS)
+        while self._slots and self._slots[0][0] <= oldest:
+            self._slots.pop(0)
+
+    def snapshot(self, now):
+        self._expire(now)
+        counts = [0] * (len(BUCKETS) + 1)
+        total = 0.0
+        maximum = 0.0
+        for slot, slotCounts, slotSum, slotMax in self._slots:
+            for i, count in enumerate(slotCounts):
+                counts[i] += count
+            total += slotSum
+            maximum = max(maximum, slotMax)
+        count = sum(counts)
+        return {
+            'count': count,
+            'mean': round(total / count, 3) if count else 0.0,
+            'p50': min(self.percentile(counts, count, 0.5), round(maximum, 3)),
+            'p90': min(self.percentile(counts, count, 0.9), round(maximum, 3)),
+            'p99': min(self.percentile(counts, count, 0.99), round(maximum, 3)),
+            'max': round(maximum, 3),
+            'buckets': counts,
+        }
+
+    @staticmethod
+    def percentile(counts, count, fraction):
+        """ Estimates a percentile by interpolating within its bucket. """
+        if not count:
+            return 0.0
+        rank = fraction * count
+        seen = 0
+        for i, bucketCount in enumerate(counts):
+            if bucketCount and seen + bucketCount >= rank:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return round(lower + (upper - lower) * (rank - seen) / bucketCount, 3)
+            seen += bucketCount
+        return BUCKETS[-1]
+
+
+class LatencyMonitor(object):
+    """ Rolling latency histograms per provider and result type. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def record(self, provider, final, lag):
+        now = time.monotonic()
+        key = (provider, 'final' if final else 'interim')
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = RollingHistogram()
+            histogram.record(max(0.0, lag), now)
+
+    def recordResult(self, response, clock):
+        """ Records the provider lag of a result. The clock is the SampleClock of the audio it was sent. """
+        if response.audio_end is None or clock is None:
+            return
+        captured = clock.captured(response.audio_end)
+        if captured is None:
+            return
+        self.record(response.provider, response.is_final, response.received - captured)
+
+    def recordPipeline(self, response):
+        self.record(PIPELINE, response.is_final, time.monotonic() - response.received)
+
+    def recordStorage(self, lag):
+        self.record(STORAGE, True, lag)
+
+    def getStatus(self):
+        now = time.monotonic()
+        status = {}
+        with self._lock:
+            for (provider, resultType), histogram in self._histograms.items():
+                status.setdefault(provider, {})[resultType] = histogram.snapshot(now)
+        return status
+
+    def getMetrics(self, gauges=None):
+        """ Returns the histograms, and the gauges given by provider, in the Prometheus text format. """
+        now = time.monotonic()
+        name = 'speakreader_result_latency_seconds'
+        lines = [
+            '# HELP %s Time from the capture of the audio to the arrival of its transcription result. The pipeline provider is the time from arrival to publication, and the storage provider from publication to the sync of the transcript.' % name,
+            '# TYPE %s histogram' % name,
+        ]
+        rolling = []
+        with self._lock:
+            for (provider, resultType), histogram in sorted(self._histograms.items()):
+                labels = 'provider="%s",type="%s"' % (provider, resultType)
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.total_counts):
+                    cumulative += count
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+                lines.append('%s_sum{%s} %.6f' % (name, labels, histogram.total_sum))
+                lines.append('%s_count{%s} %d' % (name, labels, histogram.total_count))
+
+                snapshot = histogram.snapshot(now)
+                for key, quantile in (('p50', '0.5'), ('p90', '0.9'), ('p99', '0.99')):
+                    rolling.append('%s_rolling{%s,quantile="%s"} %s' % (name, labels, quantile, snapshot[key]))
+
+        lines.append('# HELP %s_rolling Latency percentiles over the last %d seconds.' % (name, WINDOW_SECS))
+        lines.append('# TYPE %s_rolling gauge' % name)
+        lines.extend(rolling)
+
+        for provider, values in sorted((gauges or {}).items()):
+            for gauge, value in sorted(values.items()):
+                lines.append('speakreader_%s{provider="%s"} %s' % (gauge, provider, value))
+        return '\n'.join(lines) + '\n'
@@ -18,6 +18,7 @@
 
 import time
 import queue
+import asyncio
 import pyaudio
 import os
 from threading import Thread
@@ -28,6 +29,7 @@ import samplerate as sr
 
 import speakreader
 from speakreader import logger
+from speakreader.recognizer import AudioQueue, SampleClock
 
 FILENAME_PREFIX = "Transcript-"
 FILENAME_SUFFIX = "wav"
@@ -59,6 +61,8 @@ class MicrophoneStream:
         self.meter_time = float(0)
 
         self.recordingFilename = None
+        # Frames already in the recording file when this stream started appending to it.
+        self.recordingOffset = 0
 
         numdevices = self._audio_interface.get_default_host_api_info().get('deviceCount')
         defaultHostAPIindex = self._audio_interface.get_default_host_api_info().get('index')
@@ -93,8 +97,9 @@ class MicrophoneStream:
 
         self._wavfile = None
 
-        # Create a thread-safe buffer of audio data
-        self._streamBuff = queue.Queue()
+        # Audio is delivered to the recognizers through subscriptions and to the
+        # recording thread through a thread-safe buffer.
+        self._subscriptions = []
         self._recordingBuff = queue.Queue()
         self.closed = True
 
@@ -137,7 +142,8 @@ class MicrophoneStream:
         logger.debug('MicrophoneStream.exit ENTER')
         self._audio_stream.stop_stream()
         self._audio_stream.close()
-        self._streamBuff.put(None)
+        for subscription in self._subscriptions:
+            subscription.close()
         if speakreader.CONFIG.SAVE_RECORDINGS:
             self._recordingBuff.put(None)
         self.closed = True
@@ -162,7 +168,8 @@ class MicrophoneStream:
             audioData_np = audioData_np.astype(np.int16)
             in_data = audioData_np.tobytes()
 
-        self._streamBuff.put(in_data)
+        for subscription in self._subscriptions:
+            subscription.put_threadsafe(in_data)
 
         if speakreader.CONFIG.SAVE_RECORDINGS:
             self._recordingBuff.put(in_data)
@@ -195,12 +202,14 @@ class MicrophoneStream:
             wavfile = os.path.join(speakreader.CONFIG.RECORDINGS_FOLDER, self.recordingFilename)
             try:
                 w = wave.open(wavfile, 'rb')
+                self.recordingOffset = w.getnframes()
                 data = w.readframes(w.getnframes())
                 self._wavfile = wave.open(wavfile, 'wb')
                 self._wavfile.setparams(w.getparams())
                 w.close()
                 self._wavfile.writeframes(data)
             except FileNotFoundError:
+                self.recordingOffset = 0
                 self._wavfile = wave.open(wavfile, 'wb')
                 self._wavfile.setnchannels(self._num_channels)
                 self._wavfile.setsampwidth(2)
@@ -223,8 +232,16 @@ class MicrophoneStream:
     def recordingGenerator(self):
         return self._generator(self._recordingBuff)
 
-    def streamGenerator(self):
-        return self._generator(self._streamBuff)
+    def subscribe(self):
+        """ Returns an async iterator of the audio chunks for the calling event loop. """
+        subscription = AudioSubscription(asyncio.get_event_loop(), self._outputSampleRate)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        # The capture thread may be looping over the list, so it is replaced rather than changed.
+        self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+        subscription.close()
 
     def _generator(self, q):
 
@@ -253,3 +270,28 @@ class MicrophoneStream:
             yield audioData
 
         logger.debug('microphone generator loop exited')
+
+
+class AudioSubscription(AudioQueue):
+    """ Audio chunks captured by a MicrophoneStream, delivered to an event loop. """
+
+    def __init__(self, loop, sample_rate):
+        super().__init__(SampleClock(sample_rate))
+        self._loop = loop
+
+    def put_threadsafe(self, chunk):
+        try:
+            self._loop.call_soon_threadsafe(self.put_captured, chunk, time.monotonic())
+        except RuntimeError:
+            # The event loop has already been closed.
+            pass
+
+    def put_captured(self, chunk, captured):
+        self.put_nowait(chunk, self.clock.advance(chunk, captured))
+
+    def close(self):
+        try:
+            self._loop.call_soon_threadsafe(self.put_nowait, None)
+        except RuntimeError:
+            # The event loop has already been closed.
+            pass
@@ -1,7 +1,10 @@
-from queue import Queue, Empty
+import asyncio
+import json
+import time
 
 import speakreader
 from speakreader import logger
+from speakreader.recognizer import Recognizer, RecognizerError, ResultChannel
 
 try:
     import azure.cognitiveservices.speech as speechsdk
@@ -9,21 +12,24 @@ try:
 except ImportError:
     is_supported = False
 
+# Audio is pushed to the SDK in frames of this many milliseconds.
+FRAME_MS = 100
 
-class microsoftTranscribe(object):
 
-    def __init__(self, audio_device):
+class microsoftTranscribe(Recognizer):
+
+    name = 'microsoft'
+
+    def __init__(self, sample_rate, language=None):
+        super().__init__(sample_rate, language)
         self.is_supported = is_supported
         if not self.is_supported:
             return
 
-        self.audio_device = audio_device
-
-        self.eventProcessor = ProcessEvents()
-
         # Creates an instance of a speech config with specified subscription key and service region.
         self.speech_config = speechsdk.SpeechConfig(subscription=speakreader.CONFIG.MICROSOFT_SERVICE_APIKEY,
                                                     region=speakreader.CONFIG.MICROSOFT_SERVICE_REGION)
+        self.speech_config.speech_recognition_language = self.language
         self.speech_config.enable_dictation()
         RAW = 2
         MASKED = 0
@@ -32,22 +38,34 @@ class microsoftTranscribe(object):
         else:
             profanityOption = speechsdk.ProfanityOption(RAW)
         self.speech_config.set_profanity(profanityOption)
+        # The word offsets are stored with the transcript.
+        self.speech_config.request_word_level_timestamps()
+
+        self._frame_bytes = self._bytes_per_second * FRAME_MS // 1000
+        self._pushed = 0
 
+    @staticmethod
+    def configKey():
+        return (speakreader.CONFIG.MICROSOFT_SERVICE_APIKEY, speakreader.CONFIG.MICROSOFT_SERVICE_REGION,
+                speakreader.CONFIG.ENABLE_CENSORSHIP)
 
-    def transcribe(self):
+    async def recognize(self, audio):
         if not self.is_supported:
             return
-        # Generator to return transcription results
-        logger.debug("microsoftTranscribe.transcribe Enter")
+        # Async generator to return transcription results
+        logger.debug("microsoftTranscribe.recognize Enter")
+
+        loop = asyncio.get_event_loop()
+        self.startStream(audio)
+        self.eventProcessor = ProcessEvents(self, loop)
 
-        audio_format = speechsdk.audio.AudioStreamFormat(samples_per_second=16000,
+        audio_format = speechsdk.audio.AudioStreamFormat(samples_per_second=self.sample_rate,
                                                          bits_per_sample=16,
                                                          channels=1)
 
-        audio_stream_callback = AudioStreamCallback(self.audio_device._streamBuff)
-
-        audio_stream = speechsdk.audio.PullAudioInputStream(audio_stream_callback, audio_format)
-        self.audio_config = speechsdk.audio.AudioConfig(stream=audio_stream)
+        # The audio is pushed to the SDK as it arrives.
+        self.push_stream = speechsdk.audio.PushAudioInputStream(stream_format=audio_format)
+        self.audio_config = speechsdk.audio.AudioConfig(stream=self.push_stream)
 
         self.speech_recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=self.audio_config)
 
@@ -59,28 +77,65 @@ class microsoftTranscribe(object):
         self.speech_recognizer.canceled.connect(self.eventProcessor.canceled)
 
         # Start continuous speech recognition
-        self.speech_recognizer.start_continuous_recognition()
-
-        while True:
-            response = self.eventProcessor.responseQueue.get()
-            if response is None:
-                self.speech_recognizer.stop_continuous_recognition()
-                self.audio_device.closed = True
-                break
-            if response == 'canceled':
-                self.audio_device.closed = True
-                break
-
-            yield response
-
-        logger.debug("microsoftTranscribe.transcribe Exit")
-
+        await loop.run_in_executor(None, self.speech_recognizer.start_continuous_recognition)
+        feeder = asyncio.ensure_future(self.feedAudio(audio, self.push_stream))
 
-class ProcessEvents(object):
+        try:
+            while True:
+                response = await self.eventProcessor.get()
+                if response is None:
+                    break
+                if response == 'canceled':
+                    raise RecognizerError('microsoftTranscribe canceled by the Speech Service')
+
+                yield response
+        finally:
+            if not feeder.done():
+                feeder.cancel()
+                self.push_stream.close()
+            # The SDK session is stopped however the recognition ended.
+            try:
+                await loop.run_in_executor(None, self.speech_recognizer.stop_continuous_recognition)
+            except Exception as e:
+                logger.warn("microsoftTranscribe failed to stop the recognition: %s" % e)
+
+        logger.debug("microsoftTranscribe.recognize Exit")
+
+    async def feedAudio(self, audio, push_stream):
+        """ Writes the audio to the push stream in whole frames. A partial frame waits for the next chunk. """
+        self._pushed = 0
+        pending = b''
+        async for content in audio:
+            pending += content
+            size = len(pending) - len(pending) % self._frame_bytes
+            for i in range(0, size, self._frame_bytes):
+                push_stream.write(pending[i:i + self._frame_bytes])
+            pending = pending[size:]
+            self._pushed += size // 2
+
+            if size and audio.clock is not None:
+                captured = audio.clock.captured(self.streamPosition(self._pushed / self.sample_rate))
+                if captured is not None:
+                    self.metrics['feed_lag_seconds'] = round(time.monotonic() - captured, 3)
+
+        if pending:
+            push_stream.write(pending)
+            self._pushed += len(pending) // 2
+        # Closing the push stream ends the session.
+        push_stream.close()
+
+    def recordReadLag(self, audio_end):
+        """ How far the recognizer trails the audio pushed to it, in seconds. """
+        self.metrics['read_lag_seconds'] = round(max(0, self.streamPosition(self._pushed / self.sample_rate) - audio_end)
+                                         / self.sample_rate, 3)
+
+
+class ProcessEvents(ResultChannel):
     """ Class to process events returned from the Speech Service """
-    def __init__(self):
+    def __init__(self, transcriber, loop):
         logger.debug("microsoftTranscribe.ProcessEvents.Init")
-        self.responseQueue = Queue(maxsize=100)
+        super().__init__(loop, transcriber.metrics)
+        self.transcriber = transcriber
 
     def recognizing(self, evt):
         #logger.debug('microsoftTranscribe.ProcessEvents.RECOGNIZING: {}'.format(evt))
@@ -90,72 +145,51 @@ class ProcessEvents(object):
         if evt.result.text == "":
             return
 
-        response = {
-            'transcript': evt.result.text,
-            'is_final': False,
-        }
+        audio_end = self.audioEnd(evt)
+        self.transcriber.recordReadLag(audio_end)
+        response = self.transcriber.result(evt.result.text, False, audio_end=audio_end)
 
-        self.responseQueue.put_nowait(response)
+        self.put_threadsafe(response)
 
     def recognized(self, evt):
         #logger.debug('microsoftTranscribe.ProcessEvents.RECOGNIZED: {}'.format(evt))
         if evt.result.text == "":
             return
 
-        response = {
-            'transcript': evt.result.text,
-            'is_final': True,
-        }
+        audio_end = self.audioEnd(evt)
+        self.transcriber.recordReadLag(audio_end)
+        response = self.transcriber.result(evt.result.text, True, audio_end=audio_end, words=self.words(evt))
+
+        self.put_threadsafe(response)
 
-        self.responseQueue.put_nowait(response)
+    def audioEnd(self, evt):
+        # The offset and duration of a result are in ticks of 100 nanoseconds from the start of the stream.
+        return self.transcriber.streamPosition((evt.result.offset + evt.result.duration) / 10000000)
+
+    def words(self, evt):
+        try:
+            best = json.loads(evt.result.json)['NBest'][0]
+        except (ValueError, KeyError, IndexError):
+            return None
+        ticks = 10000000
+        return self.transcriber.wordTimes([(word['Word'], word['Offset'] / ticks, (word['Offset'] + word['Duration']) / ticks)
+                                           for word in best.get('Words', [])]) or None
 
     def session_started(self, evt):
         logger.debug('microsoftTranscribe.ProcessEvents.SESSION_STARTED: {}'.format(evt))
 
     def session_stopped(self, evt):
         logger.debug('microsoftTranscribe.ProcessEvents.SESSION_STOPPED {}'.format(evt))
-        self.responseQueue.put(None)
+        self.put_threadsafe(None)
 
     def canceled(self, evt):
         logger.debug('microsoftTranscribe.ProcessEvents.CANCELED: {}'.format(evt))
-        logger.error('microsoftTranscribe terminated. Ensure you have the correct API Key and service region.')
-        self.responseQueue.put('canceled')
-
-
-class AudioStreamCallback(speechsdk.audio.PullAudioInputStreamCallback):
-    """ Class that implements the Pull Audio Stream interface to return the audio stream """
-    def __init__(self, q: Queue):
-        super().__init__()
-        self.q = q
-        self.closed = False
-
-    def read(self, buffer: memoryview) -> int:
-        """read callback function"""
-        while not self.closed:
-            # Use a blocking get() to ensure there's at least one chunk of
-            # data, and stop iteration if the chunk is None, indicating the
-            # end of the audio stream.
-            chunk = self.q.get()
-            if chunk is None:
-                return 0
-            audioData = [chunk]
-
-            # Now consume whatever other data's still buffered.
-            while True:
-                try:
-                    chunk = self.q.get(block=False)
-                    if chunk is None:
-                        return 0
-                    audioData.append(chunk)
-                except Empty:
-                    break
-
-            audioData = b''.join(audioData)
-
-            buffer[:len(audioData)] = audioData
-
-            return len(audioData)
+        details = evt.cancellation_details
+        if details.reason != speechsdk.CancellationReason.Error:
+            # The push stream was closed, as when the engine stops. The session ends normally.
+            self.put_threadsafe(None)
+            return
+        logger.error('microsoftTranscribe terminated: %s. Ensure you have the correct API Key and service region.'
+                     % details.error_details)
+        self.put_threadsafe('canceled')
 
-    def close(self):
-        """close callback function"""
-        self.closed = True
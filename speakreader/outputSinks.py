@@ -0,0 +1,272 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module delivers events to other programs: as JSON datagrams over UDP, as JSON lines
+# written to a named pipe, or as JSON arrays posted to a webhook. Named pipes are not
+# supported on Windows. Each sink has a thread and a bounded queue of its own, so putting
+# an event never blocks the caller and a slow sink does not hold up the others. A sink sends the events waiting in its queue together,
+# up to max_batch, and tries a failed batch again with a growing delay before dropping it.
+# Events are dropped when the queue of a sink is full.
+
+import errno
+import json
+import os
+import queue
+import select
+import socket
+import threading
+import time
+import urllib.request
+
+from speakreader import logger
+
+# Events waiting in the queue of a sink before new ones are dropped.
+MAX_PENDING = 100
+
+# A failed batch is tried again after RETRY_SECS, doubling up to MAX_RETRY_SECS, RETRIES times.
+RETRIES = 5
+RETRY_SECS = 0.5
+MAX_RETRY_SECS = 30
+
+WEBHOOK_TIMEOUT_SECS = 5
+
+# Seconds a line longer than PIPE_BUF waits for the reader of a named pipe to take the rest of it.
+PIPE_WRITE_TIMEOUT_SECS = 1
+
+
+class OutputSink(object):
+    """ Delivers events on a thread of its own. Subclasses send them with sendBatch(). """
+
+    max_batch = 1
+
+    def __init__(self, name):
+        self.name = name
+        # Gauges shown in the metrics. The names end with their unit.
+        self.metrics = {'sink_queued': 0, 'sink_sent': 0, 'sink_dropped': 0, 'sink_retries': 0, 'sink_lag_seconds': 0.0}
+        self._queue = queue.Queue(maxsize=MAX_PENDING)
+        self._closing = threading.Event()
+        self._thread = threading.Thread(name=name, target=self.run)
+        self._thread.start()
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait((time.monotonic(), event))
+        except queue.Full:
+            self.metrics['sink_dropped'] += 1
+
+    def close(self):
+        """ Sends what is queued, without waiting for retries, and stops the thread. """
+        self._closing.set()
+        while True:
+            try:
+                self._queue.put_nowait(None)
+                break
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.metrics['sink_dropped'] += 1
+                except queue.Empty:
+                    pass
+        self._thread.join()
+
+    def run(self):
+        closing = False
+        while not closing:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                closing = True
+                batch = [item for item in batch if item is not None]
+            if batch:
+                self.deliver(batch)
+            self.metrics['sink_queued'] = self._queue.qsize()
+        self.disconnect()
+
+    def deliver(self, batch):
+        events = [event for queued, event in batch]
+        delay = RETRY_SECS
+        for attempt in range(RETRIES + 1):
+            try:
+                sent = self.sendBatch(events)
+            except Exception as e:
+                if attempt == RETRIES or self._closing.is_set():
+                    logger.warn("%s: Dropped %d events: %s" % (self.name, len(events), e))
+                    break
+                self.metrics['sink_retries'] += 1
+                if self._closing.wait(delay):
+                    continue
+                delay = min(delay * 2, MAX_RETRY_SECS)
+                continue
+            if sent:
+                self.metrics['sink_sent'] += sent
+                self.metrics['sink_lag_seconds'] = round(time.monotonic() - batch[0][0], 4)
+            self.metrics['sink_dropped'] += len(events) - sent
+            return
+        self.metrics['sink_dropped'] += len(events)
+
+    def sendBatch(self, events):
+        """
+        Sends the events. Returns how many were sent, in order, the rest being dropped on purpose.
+        Raises an exception if they are to be tried again.
+        """
+        raise NotImplementedError
+
+    def disconnect(self):
+        pass
+
+    def getMetrics(self):
+        return dict(self.metrics)
+
+
+class UdpSink(OutputSink):
+    """ Sends each event as a JSON datagram to a host and port. """
+
+    def __init__(self, name, address):
+        host, _, port = address.rpartition(':')
+        self.address = (host or 'localhost', int(port))
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        super().__init__(name)
+
+    def sendBatch(self, events):
+        for event in events:
+            self._socket.sendto(json.dumps(event).encode('utf-8'), self.address)
+        return len(events)
+
+    def disconnect(self):
+        self._socket.close()
+
+
+class PipeSink(OutputSink):
+    """
+    Writes each event as a JSON line to a named pipe. Events are dropped while no program reads
+    it. A line of up to PIPE_BUF bytes is written whole or not at all, so the reader never gets
+    part of one.
+    """
+
+    max_batch = 20
+
+    def __init__(self, name, path):
+        self.path = path
+        self._fd = None
+        super().__init__(name)
+
+    def sendBatch(self, events):
+        if self._fd is None:
+            if not os.path.exists(self.path):
+                os.mkfifo(self.path)
+            try:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # No reader.
+                    return 0
+                raise
+        for sent, event in enumerate(events):
+            try:
+                self.writeLine((json.dumps(event) + "\n").encode('utf-8'))
+            except BlockingIOError:
+                # The reader is not keeping up. Nothing of the line was written.
+                return sent
+            except OSError as e:
+                self.disconnect()
+                if e.errno == errno.EPIPE:
+                    # The reader went away.
+                    return sent
+                raise
+        return len(events)
+
+    def writeLine(self, line):
+        written = os.write(self._fd, line)
+        if written == len(line):
+            return
+        # Only a line longer than PIPE_BUF is written in parts. The rest is waited for, as the
+        # reader would otherwise be left with part of a line.
+        deadline = time.monotonic() + PIPE_WRITE_TIMEOUT_SECS
+        while written < len(line):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([], [self._fd], [], remaining)[1]:
+                logger.warn("%s: The reader of %s took part of a line. Reopening the pipe." % (self.name, self.path))
+                self.disconnect()
+                raise OSError(errno.EPIPE, "Part of a line written")
+            try:
+                written += os.write(self._fd, line[written:])
+            except BlockingIOError:
+                continue
+
+    def disconnect(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class WebhookSink(OutputSink):
+    """ Posts the events as a JSON array to a URL. """
+
+    max_batch = 20
+
+    def __init__(self, name, url):
+        self.url = url
+        super().__init__(name)
+
+    def sendBatch(self, events):
+        request = urllib.request.Request(self.url, data=json.dumps(events).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT_SECS) as response:
+            response.read()
+        return len(events)
+
+
+class SinkGroup(object):
+    """ Puts each event to every sink of a group. """
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def put(self, event):
+        for sink in self.sinks:
+            sink.put(event)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def getMetrics(self):
+        """ Returns the gauges of the sinks by sink name. """
+        return {sink.name: sink.getMetrics() for sink in self.sinks}
+
+
+def createSinks(name, udp_address=None, pipe=None, webhook_url=None):
+    """ Returns the group of the sinks that are configured, or None if there are none. """
+    sinks = []
+    try:
+        if udp_address:
+            sinks.append(UdpSink(name + '_udp', udp_address))
+        if pipe:
+            if hasattr(os, 'mkfifo'):
+                sinks.append(PipeSink(name + '_pipe', pipe))
+            else:
+                # Windows named pipes are served rather than opened like a FIFO, and are not supported.
+                logger.warn("Named pipes are not supported on this platform, so the %s output to %s is disabled. "
+                            "Use the %s UDP address or webhook instead." % (name, pipe, name))
+        if webhook_url:
+            sinks.append(WebhookSink(name + '_webhook', webhook_url))
+    except (OSError, ValueError) as e:
+        logger.error("Unable to create the %s output sinks: %s" % (name, e))
+    return SinkGroup(sinks) if sinks else None
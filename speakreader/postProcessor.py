@@ -0,0 +1,240 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module rewrites the captions with the rules of the TRANSCRIPT_RULES_FILE before
+# they are published. Each line of the file is a rule replacing a word or phrase, in any
+# case, with the text after the arrow:
+#
+#   # Names and jargon
+#   speak reader => SpeakReader
+#   nasa => NASA
+#   one hundred percent => 100%
+#
+# All the rules are compiled into one matcher, so a caption is rewritten in a single pass
+# however many rules there are. The file is read again when it or the setting changes.
+#
+# When FORMAT_NUMBERS is on and the transcript is in English, the numbers spelled out in
+# words are then written in digits, like "three thousand two hundred and five" => 3205 and
+# "nineteen eighty four" => 1984. A number under a hundred said as one word stays spelled
+# out, as in "the Ten Commandments" or "twelve apostles". Two numbers are only read as a
+# year from 1300 to 2099. Ordinals and decimals are left to the rules. FORMAT_NUMBERS is off
+# unless it is set in config.ini.
+
+import os
+import re
+import time
+
+import speakreader
+from speakreader import logger
+from speakreader.wordMatcher import WordMatcher, triePattern
+
+ARROW = '=>'
+
+# Seconds between checks of the rules file for changes.
+CHECK_SECS = 5
+
+UNITS = {'zero': 0, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9}
+TEENS = {'ten': 10, 'eleven': 11, 'twelve': 12, 'thirteen': 13, 'fourteen': 14, 'fifteen': 15, 'sixteen': 16,
+         'seventeen': 17, 'eighteen': 18, 'nineteen': 19}
+TENS = {'twenty': 20, 'thirty': 30, 'forty': 40, 'fifty': 50, 'sixty': 60, 'seventy': 70, 'eighty': 80, 'ninety': 90}
+SCALES = {'thousand': 1000, 'million': 1000000, 'billion': 1000000000}
+
+# Numbers under this said as one word stay spelled out.
+SPELLED_BELOW = 100
+
+# The first half of a year said in two, like the nineteen of nineteen eighty four.
+YEAR_CENTURIES = range(13, 21)
+
+# Numbers from this on are written with thousands separators.
+SEPARATORS_FROM = 10000
+
+
+def loadRules(filename):
+    """ Returns the (phrase, replacement) rules of a rules file. """
+    rules = []
+    with open(filename, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            phrase, arrow, replacement = line.partition(ARROW)
+            phrase = ' '.join(phrase.split())
+            if not arrow or not phrase:
+                logger.warn("PostProcessor: Ignoring line %d of %s. Rules are written as: phrase %s replacement"
+                            % (number, os.path.basename(filename), ARROW))
+                continue
+            rules.append((phrase, replacement.strip()))
+    return rules
+
+
+class RuleSet(object):
+    """ Replaces the phrases of the rules in one pass. The last rule for a phrase wins. """
+
+    def __init__(self, rules):
+        self.replacements = {phrase.lower(): replacement for phrase, replacement in rules}
+        self.matcher = WordMatcher(self.replacements.keys())
+
+    def __len__(self):
+        return len(self.replacements)
+
+    def apply(self, text):
+        if not self.replacements:
+            return text
+        return self.matcher.sub(self._replace, text)
+
+    def _replace(self, match):
+        return self.replacements.get(match.group().lower(), match.group())
+
+
+class NumberFormatter(object):
+    """ Writes the numbers spelled out in English words in digits, in one pass over the text. """
+
+    def __init__(self):
+        word = triePattern(list(UNITS) + list(TEENS) + list(TENS) + ['hundred'] + list(SCALES))
+        # A run of number words, joined by spaces, hyphens, "and", or the "oh" of years like nineteen oh five.
+        self.pattern = re.compile(r'(?<!\w)%s(?:(?:\s+(?:and|oh)\s+|[\s-]+)%s)*(?!\w)' % (word, word), re.IGNORECASE)
+        self.word = re.compile(r'[a-z]+', re.IGNORECASE)
+
+    def apply(self, text):
+        return self.pattern.sub(self._replace, text)
+
+    def _replace(self, match):
+        run = match.group()
+        tokens = [(m.group().lower(), m.start(), m.end()) for m in self.word.finditer(run)]
+        parts = []
+        position = 0
+        for value, first, last in self.numbers([token[0] for token in tokens]):
+            start, end = tokens[first][1], tokens[last][2]
+            parts.append(run[position:start])
+            if first == last and value < SPELLED_BELOW:
+                parts.append(run[start:end])
+            elif value >= SEPARATORS_FROM:
+                parts.append('{:,}'.format(value))
+            else:
+                parts.append(str(value))
+            position = end
+        parts.append(run[position:])
+        return ''.join(parts)
+
+    @classmethod
+    def numbers(cls, words):
+        """ Yields the (value, first, last) word indexes of the numbers in a run of number words. """
+        i = 0
+        while i < len(words):
+            if words[i] in ('and', 'oh'):
+                i += 1
+                continue
+            state = cls.accept(None, words[i])
+            if state is None:
+                # Like "thousand" on its own.
+                i += 1
+                continue
+            first = last = i
+            j = i + 1
+            while j < len(words):
+                if words[j] == 'oh':
+                    # Years, like nineteen oh five.
+                    if state[2] not in ('teen', 'tens') or state[4] or state[0] or state[1] not in YEAR_CENTURIES \
+                            or j + 1 == len(words) or UNITS.get(words[j + 1], 0) == 0:
+                        break
+                    state, last, j = (0, state[1] * 100 + UNITS[words[j + 1]], 'unit', None, True), j + 1, j + 2
+                    continue
+                if words[j] == 'and':
+                    # "and" only joins a hundred or a thousand to the tens and units after it.
+                    if state[2] not in ('hundred', 'scale') or j + 1 == len(words) \
+                            or words[j + 1] not in UNITS and words[j + 1] not in TEENS and words[j + 1] not in TENS:
+                        break
+                    following = cls.accept(state, words[j + 1])
+                    if following is None:
+                        break
+                    state, last, j = following, j + 1, j + 2
+                    continue
+                following = cls.accept(state, words[j])
+                if following is None:
+                    break
+                state, last, j = following, j, j + 1
+            yield state[0] + state[1], first, last
+            i = last + 1
+
+    @staticmethod
+    def accept(state, word):
+        """
+        Returns the (total, current, kind, scale, year) state after a number word, or None if the
+        word starts another number. current is the part under the last thousand, million or billion.
+        """
+        total, current, kind, scale, year = state or (0, 0, None, None, False)
+        if word in UNITS:
+            if word == 'zero':
+                return (0, 0, 'zero', None, False) if state is None else None
+            if kind in (None, 'tens', 'hundred', 'scale') and (kind != 'tens' or current % 10 == 0):
+                return total, current + UNITS[word], 'unit', scale, year
+        elif word in TEENS or word in TENS:
+            value = TEENS.get(word) or TENS[word]
+            if kind in (None, 'hundred', 'scale'):
+                return total, current + value, 'teen' if word in TEENS else 'tens', scale, year
+            if kind in ('teen', 'tens') and total == 0 and current in YEAR_CENTURIES and not year:
+                # Years, like nineteen eighty or twenty twenty.
+                return 0, current * 100 + value, 'teen' if word in TEENS else 'tens', None, True
+        elif word == 'hundred':
+            if kind in ('unit', 'teen', 'tens') and 1 <= current <= 99 and not year:
+                return total, current * 100, 'hundred', scale, year
+        elif word in SCALES:
+            if kind in ('unit', 'teen', 'tens', 'hundred') and current and not year \
+                    and (scale is None or SCALES[word] < scale):
+                return total + current * SCALES[word], 0, 'scale', SCALES[word], year
+        return None
+
+
+class PostProcessor(object):
+    """ Applies the rules of the configured rules file to the captions, then formats the numbers. """
+
+    def __init__(self):
+        self.numberFormatter = NumberFormatter()
+        self._rules = RuleSet(())
+        self._source = None
+        self._checked = 0.0
+
+    def ruleSet(self):
+        now = time.monotonic()
+        filename = speakreader.CONFIG.TRANSCRIPT_RULES_FILE
+        if now - self._checked < CHECK_SECS and self._source is not None and self._source[0] == filename:
+            return self._rules
+        self._checked = now
+
+        try:
+            source = (filename, os.path.getmtime(filename)) if filename else (filename, None)
+        except OSError:
+            source = (filename, None)
+        if source != self._source:
+            self._source = source
+            self._rules = RuleSet(())
+            if source[1] is not None:
+                try:
+                    start = time.perf_counter()
+                    self._rules = RuleSet(loadRules(filename))
+                    logger.info("PostProcessor: Compiled %d rules in %.1f ms"
+                                % (len(self._rules), (time.perf_counter() - start) * 1000))
+                except (OSError, UnicodeDecodeError) as e:
+                    logger.warn("PostProcessor: Unable to read %s: %s" % (filename, e))
+            elif filename:
+                logger.warn("PostProcessor: Rules file %s not found" % filename)
+        return self._rules
+
+    def __call__(self, text):
+        text = self.ruleSet().apply(text)
+        if speakreader.CONFIG.FORMAT_NUMBERS and speakreader.CONFIG.TRANSCRIPT_LANGUAGE.lower().startswith('en'):
+            text = self.numberFormatter.apply(text)
+        return text
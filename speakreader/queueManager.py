@@ -15,15 +15,74 @@
 # **************************************************************************************
 
 # This module manages the queues.
-
+#
+# Each handler publishes its events once, to a ring of the latest RING_SIZE events
+# numbered in order. A listener only keeps a cursor, the number of the next event it
+# reads, and waits on the condition of the ring. Publishing an event therefore costs the
+# same however many listeners there are. A listener that falls RING_SIZE events behind,
+# because it stopped reading, is closed.
+#
+# The events are encoded into their server-sent event frame when they are published, and
+# every connection writes the same bytes. The encoding uses orjson if it is installed.
+#
+# The frames of the ring carry the id of their event. A browser that lost its connection
+# reconnects with the id of the last event it received, and is sent the events it missed
+# rather than the whole transcript again, as long as they are still in the ring.
+#
+# A new listener is sent the file so far as one event. The transcript and log handlers keep
+# it rendered in a snapshot, added to as the events are published, so a crowd joining at
+# once does not each read the whole file.
+
+import binascii
+import collections
+import gzip
+import json
 import threading
 import queue
+import os
+import time
 from queue import Queue
 
 from speakreader import logger
 import logging
 from logging import handlers
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Events kept for the listeners of a handler.
+RING_SIZE = 1000
+
+# Seconds between checks for listeners that fell behind the ring.
+SWEEP_SECS = 2
+
+
+def encodeEvent(data, eventId=None):
+    """ Returns the server-sent event frame of an event. """
+    frame = None
+    if orjson is not None:
+        try:
+            frame = b'data: ' + orjson.dumps(data) + b'\n\n'
+        except TypeError:
+            # Types orjson does not handle, like integers of more than 64 bits.
+            pass
+    if frame is None:
+        frame = ('data: %s\n\n' % json.dumps(data)).encode('utf-8')
+    if eventId is not None:
+        frame = b'id: ' + eventId.encode('ascii') + b'\n' + frame
+    return frame
+
+
+class ListenerOverrun(Exception):
+    """ Raised to a listener that fell so far behind that the events it missed are no longer kept. """
+    pass
+
+
+PING_FRAME = encodeEvent({"event": "ping"})
+CLOSE_FRAME = encodeEvent({"event": "close"})
+
 
 class QueueManager(object):
 
@@ -37,6 +96,9 @@ class QueueManager(object):
         self.transcriptHandler = TranscriptHandler("TranscriptQueueHandler")
         self.logHandler = LogHandler("LogQueueHandler")
         self.meterHandler = MeterHandler("SoundMeterQueueHandler")
+        self.alertHandler = AlertHandler("AlertQueueHandler")
+        # The transcript handlers of the captions in other languages, by language.
+        self.languageHandlers = {}
         self._INITIALIZED = True
 
     @property
@@ -48,38 +110,76 @@ class QueueManager(object):
         self.transcriptHandler.shutdown()
         self.logHandler.shutdown()
         self.meterHandler.shutdown()
+        self.alertHandler.shutdown()
+        for handler in self.languageHandlers.values():
+            handler.shutdown()
         logger.info("Queue Manager terminated")
 
     def closeAllListeners(self):
         self.transcriptHandler.closeAllListeners()
         self.logHandler.closeAllListeners()
-
-    def addListener(self, type=None, sessionID=None, remoteIP=None):
-        if type == "log":
-            return self.logHandler.addListener(type=type, sessionID=sessionID, remoteIP=remoteIP)
-        elif type == "transcript":
-            return self.transcriptHandler.addListener(type=type, sessionID=sessionID, remoteIP=remoteIP)
-        elif type == "meter":
-            return self.meterHandler.addListener(type=type, sessionID=sessionID, remoteIP=remoteIP)
+        for handler in self.languageHandlers.values():
+            handler.closeAllListeners()
+
+    def addLanguage(self, language):
+        """ Returns the transcript handler of the captions in a language, created the first time. """
+        handler = self.languageHandlers.get(language)
+        if handler is None:
+            handler = TranscriptHandler("TranscriptQueueHandler-%s" % language)
+            handler.transcriptStore = self.transcriptHandler.transcriptStore
+            self.languageHandlers[language] = handler
+        return handler
+
+    def languageHandler(self, lang):
+        """ Returns the transcript handler of a language like es-ES, or of the first language like es. """
+        lang = lang.lower()
+        for language, handler in self.languageHandlers.items():
+            if language.lower() == lang:
+                return handler
+        for language, handler in self.languageHandlers.items():
+            if language.lower().split('-')[0] == lang:
+                return handler
         return None
 
+    def addListener(self, type=None, sessionID=None, remoteIP=None, lang=None, lastEventId=None, status=None, etag=None):
+        if type == "transcript" and lang:
+            handler = self.languageHandler(lang)
+        else:
+            handler = {"log": self.logHandler,
+                       "transcript": self.transcriptHandler,
+                       "meter": self.meterHandler,
+                       "alert": self.alertHandler,
+                       }.get(type)
+        if handler is None:
+            return None
+        return handler.addListener(type=type, sessionID=sessionID, remoteIP=remoteIP,
+                                   lastEventId=lastEventId, status=status, etag=etag)
+
     def removeListener(self, type=None, sessionID=None, remoteIP=None):
         if type == "log":
             self.logHandler.removeListener(sessionID=sessionID)
         elif type == "transcript":
-            self.transcriptHandler.removeListener(sessionID=sessionID)
+            for handler in [self.transcriptHandler] + list(self.languageHandlers.values()):
+                if handler.hasListener(sessionID):
+                    handler.removeListener(sessionID=sessionID)
         elif type == "meter":
             self.meterHandler.removeListener(sessionID=sessionID)
+        elif type == "alert":
+            self.alertHandler.removeListener(sessionID=sessionID)
 
     def getUsage(self):
         usage = {}
         usage['transcript'] = self.transcriptHandler.getUsage()
         usage['log'] = self.logHandler.getUsage()
+        usage['languages'] = {language: handler.getUsage() for language, handler in self.languageHandlers.items()}
         return usage
 
 
 class QueueHandler(object):
 
+    # The file so far, for the handlers that send it to new listeners.
+    snapshot = None
+
     def __init__(self, name):
         self._STARTED = False
         self.fileLock = threading.Lock()
@@ -89,6 +189,8 @@ class QueueHandler(object):
 
         # Initialize the Handler queue manager
         self._receiverQueue = Queue(maxsize=-1)
+        self._ring = EventRing(RING_SIZE)
+        self._lastSweep = time.monotonic()
         self._queueHandlerThread = threading.Thread(name=self.threadName, target=self.runHandler)
         self._queueHandlerThread.start()
 
@@ -111,65 +213,97 @@ class QueueHandler(object):
         pass
 
 
-    def addListener(self, type=None, remoteIP=None, sessionID=None):
+    def addListener(self, type=None, remoteIP=None, sessionID=None, lastEventId=None, status=None, etag=None):
+        """
+        Returns the cursor of a new listener. A listener reconnecting with the id of the last
+        event it received is only sent the events after it, if they are still in the ring.
+        Otherwise it is sent the file so far, unless it already has the snapshot with this
+        etag, then the status event, if any.
+        """
         if not self._STARTED or  not remoteIP or not sessionID:
             return None
 
-        logger.info("Adding " + type.capitalize() + " Listener Queue for IP: " + remoteIP + " with SessionID: " + sessionID)
-
-        if type == 'meter':
-            maxsize = 200
+        queueElement = ListenerCursor(self._ring, type=type, remoteIP=remoteIP, sessionID=sessionID)
+        resumed = lastEventId is not None and queueElement.resume(lastEventId)
+        if resumed:
+            logger.info("Resuming " + type.capitalize() + " Listener Queue for IP: " + remoteIP + " with SessionID: " + sessionID)
         else:
-            maxsize = 20
+            logger.info("Adding " + type.capitalize() + " Listener Queue for IP: " + remoteIP + " with SessionID: " + sessionID)
 
-        queueElement = QueueElement(type=type, remoteIP=remoteIP, sessionID=sessionID, maxsize=maxsize)
+        replaced = self._listenerQueues.get(sessionID)
         self._listenerQueues[sessionID] = queueElement
+        if replaced is not None:
+            # The same session listening again. The earlier stream would no longer be tracked.
+            replaced.close()
 
         data = {"event": "open",
                 "sessionID": sessionID,
                 }
         queueElement.put_nowait(data)
 
-        data = None
-        if type == "log":
-            if self.fileName:
-                with open(self.fileName) as f:
-                    records = '<p>' + f.read().replace("\n", "</p><p>") + '</p>'
-                data = {"event": "logrecord",
-                        "final": "reload",
-                        "record": records,
-                        }
-        elif type == "transcript":
-            if self.fileName:
-                with open(self.fileName, 'r') as f:
-                    records = "<p>" + f.read().rstrip("\n\n").replace("\n\n", "</p><p>") + "</p>"
-                data = {"event": "transcript",
-                        "final": "reload",
-                        "record": records,
-                        }
+        if resumed:
+            return queueElement
 
-        if data:
-            queueElement.put_nowait(data)
+        rendering = self.snapshot.render() if self.snapshot is not None else None
+        if rendering is not None and rendering.etag != etag:
+            # A reconnect after the reload only needs the events published since.
+            eventId = self._ring.eventId(queueElement.cursor - 1)
+            queueElement.putFrame(b'id: ' + eventId.encode('ascii') + b'\n' + rendering.frame)
 
-        return queueElement.listenerQueue
+        if status:
+            queueElement.put_nowait(status)
 
+        self.catchUp(queueElement)
 
-    def removeListener(self, sessionID=None, listenerQueue=None):
+        return queueElement
+
+    def catchUp(self, queueElement):
+        """ Sends a new listener whatever it needs to follow the events already in flight. """
+        pass
+
+    def loadTranscript(self, filename):
+        """ Returns the paragraphs of the transcript file. """
+        try:
+            with open(filename, 'r') as f:
+                return f.read().rstrip("\n\n").split("\n\n")
+        except OSError as e:
+            logger.error("Unable to read transcript %s: %s" % (filename, e))
+            return []
+
+
+    def publish(self, data):
+        """ Makes an event available to every listener. """
+        self._ring.append(data)
+        now = time.monotonic()
+        if now - self._lastSweep >= SWEEP_SECS:
+            self._lastSweep = now
+            self.sweep()
+
+    def sweep(self):
+        """ Removes the listeners that fell behind the ring or were closed. """
+        for queueElement in list(self._listenerQueues.values()):
+            if queueElement.closed or queueElement.overrun:
+                self.removeListener(sessionID=queueElement.sessionID)
 
-        queueElement = None
-        if sessionID is not None:
-            queueElement = self._listenerQueues[sessionID]
+    def removeListener(self, sessionID=None, listenerQueue=None):
 
-        elif listenerQueue is not None:
-            for sessionID, queueElement in self._listenerQueues.items():
-                if queueElement.listenerQueue == listenerQueue:
+        if sessionID is None and listenerQueue is not None:
+            for sessionID, queueElement in list(self._listenerQueues.items()):
+                if queueElement is listenerQueue:
                     break
+            else:
+                sessionID = None
+
+        # The listener may be removed at once by its generator, the sweep and closeAllListeners.
+        # Only the thread that pops it closes it.
+        queueElement = self._listenerQueues.pop(sessionID, None) if sessionID is not None else None
 
         if queueElement is not None:
             logger.info("Removing " + queueElement.type.capitalize() + " Listener Queue for IP: " + queueElement.remoteIP + " with SessionID: " + sessionID)
-            queueElement.clear()
-            queueElement.put_nowait(None)
-            self._listenerQueues.pop(sessionID)
+            queueElement.close()
+
+    def hasListener(self, sessionID):
+        return sessionID in self._listenerQueues
 
     def closeAllListeners(self):
         for sessionID in list(self._listenerQueues.keys()):
@@ -190,6 +324,56 @@ class QueueHandler(object):
 
 
 class TranscriptHandler(QueueHandler):
+    """
+    Interim results are sent as a change to the previous interim result. The event keeps
+    the first 'keep' characters of the previous text and adds 'append' to them.
+    """
+
+    def __init__(self, name):
+        self._interim = ""
+        self._interimLock = threading.Lock()
+        # The TranscriptStore the transcript is reloaded from.
+        self.transcriptStore = None
+        self.snapshot = Snapshot("transcript")
+        super().__init__(name)
+
+    def setFileName(self, filename):
+        # The snapshot is loaded before the finals of the session are published.
+        paragraphs = self.loadTranscript(filename) if filename else None
+        with self._interimLock:
+            self.fileName = filename
+            self.snapshot.reset(paragraphs)
+
+    def addListener(self, type=None, remoteIP=None, sessionID=None, lastEventId=None, status=None, etag=None):
+        # The listener must not miss an interim event between its catch up and its first delta.
+        with self._interimLock:
+            return super().addListener(type=type, remoteIP=remoteIP, sessionID=sessionID,
+                                       lastEventId=lastEventId, status=status, etag=etag)
+
+    def loadTranscript(self, filename):
+        name = os.path.basename(filename)
+        if self.transcriptStore is not None and self.transcriptStore.importText(name, filename):
+            return self.transcriptStore.texts(name)
+        return super().loadTranscript(filename)
+
+    def catchUp(self, queueElement):
+        if self._interim:
+            queueElement.put_nowait({"event": "transcript", "final": False, "record": self._interim})
+
+    def encode(self, transcript):
+        if transcript.get('event') != 'transcript' or transcript.get('final') is not False:
+            self._interim = ""
+            return transcript
+
+        record = transcript['record']
+        keep = len(os.path.commonprefix([self._interim, record]))
+        self._interim = record
+        if keep == 0:
+            return transcript
+        # The browser counts the characters kept in UTF-16 code units, where a character outside
+        # the Basic Multilingual Plane, like an emoji, takes two.
+        kept = len(record[:keep].encode('utf-16-le')) // 2
+        return {"event": "transcript", "final": False, "keep": kept, "append": record[keep:]}
 
     def runHandler(self):
         if self._STARTED:
@@ -211,11 +395,14 @@ class TranscriptHandler(QueueHandler):
                 else:
                     break
 
-            for queueElement in list(self._listenerQueues.values()):
-                try:
-                    queueElement.put_nowait(transcript)
-                except queue.Full:
-                    self.removeListener(sessionID=queueElement.sessionID)
+            with self._interimLock:
+                if transcript.get('event') != 'ping':
+                    transcript = self.encode(transcript)
+                    if transcript.get('event') == 'transcript' and transcript.get('final') is True:
+                        # As the transcript writer adds it to the file.
+                        self.snapshot.append(transcript['record'].strip())
+
+                self.publish(transcript)
 
         self._STARTED = False
         self.closeAllListeners()
@@ -224,6 +411,16 @@ class TranscriptHandler(QueueHandler):
 
 class LogHandler(QueueHandler):
 
+    def __init__(self, name):
+        self._snapshotLock = threading.Lock()
+        super().__init__(name)
+
+    def addListener(self, type=None, remoteIP=None, sessionID=None, lastEventId=None, status=None, etag=None):
+        # The snapshot and the cursor of the listener are taken together, so no record is sent twice.
+        with self._snapshotLock:
+            return super().addListener(type=type, remoteIP=remoteIP, sessionID=sessionID,
+                                       lastEventId=lastEventId, status=status, etag=etag)
+
     def runHandler(self):
         if self._STARTED:
             logger.warn('Log Queue Handler already started')
@@ -233,16 +430,23 @@ class LogHandler(QueueHandler):
         self._STARTED = True
 
         mainLogger = logging.getLogger("SpeakReader")
-        self.queueHandler = handlers.QueueHandler(self._receiverQueue)
-        self.queueHandler.setFormatter(logger.log_format)
-        self.queueHandler.setLevel(logger.log_level)
-        mainLogger.addHandler(self.queueHandler)
-
+        # The log is read before its records are queued, and is then kept to the size of the log file.
+        self.snapshot = Snapshot("logrecord", maxChars=logger.MAX_SIZE)
         for handler in mainLogger.handlers[:]:
             if isinstance(handler, handlers.RotatingFileHandler):
                 self.fileName = handler.baseFilename
+                try:
+                    with open(self.fileName) as f:
+                        self.snapshot.reset(f.read().split("\n"))
+                except OSError as e:
+                    logger.error("Unable to read log file %s: %s" % (self.fileName, e))
                 break
 
+        self.queueHandler = handlers.QueueHandler(self._receiverQueue)
+        self.queueHandler.setFormatter(logger.log_format)
+        self.queueHandler.setLevel(logger.log_level)
+        mainLogger.addHandler(self.queueHandler)
+
         while self._STARTED:
             try:
                 logRecord = self._receiverQueue.get(timeout=2)
@@ -267,11 +471,10 @@ class LogHandler(QueueHandler):
                 else:
                     break
 
-            for queueElement in list(self._listenerQueues.values()):
-                try:
-                    queueElement.put_nowait(data)
-                except queue.Full:
-                    self.removeListener(sessionID=queueElement.sessionID)
+            with self._snapshotLock:
+                if data.get('event') == 'logrecord':
+                    self.snapshot.append(data['record'])
+                self.publish(data)
 
         self._STARTED = False
         self.closeAllListeners()
@@ -305,34 +508,234 @@ class MeterHandler(QueueHandler):
                 else:
                     break
 
-            for queueElement in list(self._listenerQueues.values()):
-                try:
-                    queueElement.put_nowait(data)
-                except queue.Full:
-                    self.removeListener(sessionID=queueElement.sessionID)
+            self.publish(data)
 
         self._STARTED = False
         self.closeAllListeners()
         logger.info('Sound Meter Queue Handler terminated')
 
 
-class QueueElement(object):
-    type = None
-    sessionID = None
-    remoteIP = None
-    listenerQueue = None
+class AlertHandler(QueueHandler):
+
+    def runHandler(self):
+        if self._STARTED:
+            logger.warn('Alert Queue Handler already started')
+            return
+
+        logger.info('Alert Queue Handler starting')
+        self._STARTED = True
+
+        while self._STARTED:
+            try:
+                data = self._receiverQueue.get(timeout=2)
+                if data is None:
+                    break
+
+            except queue.Empty:
+                if self._STARTED:
+                    data = {"event": "ping"}
+                else:
+                    break
+
+            self.publish(data)
+
+        self._STARTED = False
+        self.closeAllListeners()
+        logger.info('Alert Queue Handler terminated')
+
+
+class EventRing(object):
+    """ The frames of the latest events of a handler. Event number seq is kept in slot seq % size. """
+
+    def __init__(self, size):
+        self.size = size
+        self._events = [None] * size
+        # The number of the next event.
+        self.next = 0
+        self.condition = threading.Condition()
+        # The event ids start with this, so the ids sent before a restart are not taken for new ones.
+        self.epoch = binascii.hexlify(os.urandom(4)).decode('ascii')
+
+    @property
+    def first(self):
+        """ The number of the oldest event kept. """
+        return max(0, self.next - self.size)
+
+    def append(self, data):
+        # Encoded before the lock is taken, so readers only wait for the append.
+        frame = PING_FRAME if data.get('event') == 'ping' and len(data) == 1 else encodeEvent(data)
+        with self.condition:
+            self._events[self.next % self.size] = b'id: %s-%d\n' % (self.epoch.encode('ascii'), self.next) + frame
+            self.next += 1
+            self.condition.notify_all()
+
+    def event(self, seq):
+        return self._events[seq % self.size]
+
+    def eventId(self, seq):
+        return '%s-%d' % (self.epoch, seq)
+
+    def parseEventId(self, eventId):
+        """ Returns the number of an event id of this ring, or None. """
+        epoch, _, seq = eventId.strip().partition('-')
+        if epoch != self.epoch:
+            return None
+        try:
+            return int(seq)
+        except ValueError:
+            return None
+
+
+class Snapshot(object):
+    """
+    The paragraphs of the file of a handler, as they are sent to a new listener. They are only
+    rendered again after they change. Until it is loaded with reset(), render() returns None.
+    """
+
+    def __init__(self, event, maxChars=None):
+        self.event = event
+        self.maxChars = maxChars
+        self._paragraphs = None
+        self._chars = 0
+        self._lock = threading.Lock()
+        self._rendering = None
+        # The etags start with this, so the etags sent before a restart do not match.
+        self.epoch = binascii.hexlify(os.urandom(4)).decode('ascii')
+        self.version = 0
+
+    def reset(self, paragraphs):
+        with self._lock:
+            self._paragraphs = None
+            self._chars = 0
+            if paragraphs is not None:
+                self._paragraphs = collections.deque()
+                for paragraph in paragraphs:
+                    self._add(paragraph)
+            self._changed()
+
+    def append(self, paragraph):
+        with self._lock:
+            if self._paragraphs is not None:
+                self._add(paragraph)
+                self._changed()
+
+    def _add(self, paragraph):
+        self._paragraphs.append(paragraph)
+        self._chars += len(paragraph)
+        while self.maxChars is not None and self._chars > self.maxChars and len(self._paragraphs) > 1:
+            self._chars -= len(self._paragraphs.popleft())
+
+    def _changed(self):
+        self.version += 1
+        self._rendering = None
+
+    def render(self):
+        """ Returns the SnapshotRendering of the paragraphs, or None if the snapshot is not loaded. """
+        with self._lock:
+            if self._paragraphs is None:
+                return None
+            if self._rendering is None:
+                html = "<p>" + "</p><p>".join(self._paragraphs) + "</p>"
+                self._rendering = SnapshotRendering('"%s-%d"' % (self.epoch, self.version), self.event, html)
+            return self._rendering
+
+
+class SnapshotRendering(object):
+    """ A version of a snapshot, as the HTML of its paragraphs and as the frame of a reload event. """
+
+    def __init__(self, etag, event, html):
+        self.etag = etag
+        self.html = html.encode('utf-8')
+        self.frame = encodeEvent({"event": event,
+                                  "final": "reload",
+                                  "record": html,
+                                  })
+        self._gzipped = None
+
+    @property
+    def gzipped(self):
+        # Compressed on first use. Two threads compressing at once both get the same bytes.
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.html, mtime=0)
+        return self._gzipped
 
-    def __init__(self, type, remoteIP, sessionID, maxsize=10):
-        self.listenerQueue = Queue(maxsize=maxsize)
+
+class ListenerCursor(object):
+    """
+    A listener of a handler. It reads the events of the ring from its cursor on. The
+    events for this listener only, like the transcript so far, are read first.
+    """
+
+    def __init__(self, ring, type, remoteIP, sessionID):
         self.type = type.lower()
         self.remoteIP = remoteIP
         self.sessionID = sessionID
+        self.closed = False
+        self._ring = ring
+        self._pending = collections.deque()
+        with ring.condition:
+            self.cursor = ring.next
 
-    def put_nowait(self, data):
-        self.listenerQueue.put_nowait(data)
-
-    def put(self, data):
-        self.listenerQueue.put(data)
-
-    def clear(self):
-        self.listenerQueue.queue.clear()
+    @property
+    def overrun(self):
+        return self.cursor < self._ring.first
+
+    def resume(self, lastEventId):
+        """ Moves the cursor to the event after lastEventId. Returns False if that event is not in the ring. """
+        ring = self._ring
+        with ring.condition:
+            seq = ring.parseEventId(lastEventId)
+            if seq is None or not ring.first - 1 <= seq < ring.next:
+                return False
+            self.cursor = seq + 1
+            return True
+
+    def put_nowait(self, data, eventId=None):
+        """ Sends an event to this listener only. """
+        self.putFrame(encodeEvent(data, eventId))
+
+    def putFrame(self, frame):
+        with self._ring.condition:
+            self._pending.append(frame)
+            self._ring.condition.notify_all()
+
+    def put(self, data, eventId=None):
+        self.put_nowait(data, eventId)
+
+    def get(self, timeout=None):
+        """
+        Returns the frame of the next event, or None once the listener is closed. Raises queue.Empty
+        after timeout seconds, and ListenerOverrun when the next event is no longer in the ring.
+        """
+        deadline = None
+        ring = self._ring
+        with ring.condition:
+            while True:
+                if self._pending:
+                    return self._pending.popleft()
+                cursor = self.cursor
+                if cursor < ring.next - ring.size:
+                    # Missed events can not be sent. The listener is removed by the next sweep, and
+                    # its browser reconnects for the file so far.
+                    self.closed = True
+                    raise ListenerOverrun
+                if self.closed:
+                    return None
+                if cursor < ring.next:
+                    self.cursor = cursor + 1
+                    return ring.event(cursor)
+                if timeout is None:
+                    ring.condition.wait()
+                    continue
+                if deadline is None:
+                    deadline = time.monotonic() + timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise queue.Empty
+                ring.condition.wait(remaining)
+
+    def close(self):
+        with self._ring.condition:
+            self.closed = True
+            self._pending.clear()
+            self._ring.condition.notify_all()
@@ -0,0 +1,267 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module defines the interface shared by the speech-to-text services. A recognizer
+# takes an async iterator of audio chunks and returns an async iterator of results. All
+# recognizers run on the transcribe engine's event loop.
+
+import asyncio
+import collections
+import time
+
+import speakreader
+from speakreader import logger
+
+# Seconds of capture times kept by a SampleClock.
+CLOCK_HISTORY_SECS = 600
+
+
+class RecognizerError(Exception):
+    """ Raised by a recognizer when the service can not continue. """
+    pass
+
+
+class RecognitionResult(object):
+    """ A transcription result returned by a recognizer. """
+    __slots__ = ('transcript', 'is_final', 'provider', 'audio_end', 'words', 'received')
+
+    def __init__(self, transcript, is_final, provider=None, audio_end=None, words=None):
+        self.transcript = transcript
+        self.is_final = is_final
+        self.provider = provider
+        # Sample clock position of the end of the audio the result covers.
+        self.audio_end = audio_end
+        # (word, start, end) sample clock positions of the words, if the service returns them.
+        self.words = words
+        # When the result arrived from the service.
+        self.received = time.monotonic()
+
+    def __repr__(self):
+        return "RecognitionResult(%r, is_final=%r, provider=%r)" % (self.transcript, self.is_final, self.provider)
+
+
+class Recognizer(object):
+    """ Base class for the speech-to-text services. """
+
+    name = None
+    is_supported = False
+    # Whether the same audio always gives the same transcript, so results can be cached.
+    is_deterministic = True
+    # Whether the service is told the language to transcribe. Otherwise its model decides.
+    supports_language = True
+
+    def __init__(self, sample_rate, language=None):
+        # The audio is 16 bit mono at this sample rate.
+        self.sample_rate = sample_rate
+        # BCP-47 code of the language spoken, like en-US.
+        self.language = language or speakreader.CONFIG.TRANSCRIPT_LANGUAGE
+        self._bytes_per_second = sample_rate * 2
+        self._audio = None
+        self._stream_start = 0
+        # Gauges of the service shown in the admin status. The names end with their unit.
+        self.metrics = {}
+
+    @staticmethod
+    def configKey():
+        """ Returns the settings the service depends on. A new instance is needed when they change. """
+        return ()
+
+    async def warmup(self):
+        """ Prepares the service, such as fetching auth tokens, so the first results come quickly. """
+        pass
+
+    def recognize(self, audio):
+        """
+        Returns an async iterator of RecognitionResult for the audio async iterator.
+        The iterator ends when the audio ends or the service closes the stream.
+        """
+        raise NotImplementedError
+
+    async def transcribe(self, content):
+        """
+        Returns the final transcript of a complete piece of audio. Services with a
+        non-streaming API override this. The others stream the audio at once.
+        """
+        audio = AudioQueue()
+        audio.put_nowait(content)
+        audio.put_nowait(None)
+        finals = []
+        async for result in self.recognize(audio):
+            if result.is_final and result.transcript.strip():
+                finals.append(result.transcript.strip())
+        return ' '.join(finals)
+
+    def getMetrics(self):
+        """ Returns the gauges of the service by service name. """
+        return {self.name: dict(self.metrics)} if self.metrics else {}
+
+    def startStream(self, audio):
+        """ Called when recognize starts reading the audio. Offsets reported by the service count from here. """
+        self._audio = audio
+        self._stream_start = audio.position
+
+    def streamPosition(self, seconds):
+        """ Returns the sample clock position of an offset in seconds from the start of the stream. """
+        return self._stream_start + int(seconds * self.sample_rate)
+
+    def result(self, transcript, is_final, audio_end=None, words=None):
+        return RecognitionResult(transcript, is_final, provider=self.name, audio_end=audio_end, words=words)
+
+    def wordTimes(self, words):
+        """ Returns the (word, start, end) sample clock positions of (word, start, end) offsets in seconds from the start of the stream. """
+        return [(word, self.streamPosition(start), self.streamPosition(end)) for word, start, end in words]
+
+
+class ResultChannel(object):
+    """
+    Hands results from SDK callback threads to the event loop without losing any.
+    While the reader is behind, a new interim result replaces the interim result waiting
+    at the end of the backlog. Final results and end markers are always kept.
+    """
+
+    def __init__(self, loop, metrics=None):
+        self._loop = loop
+        self._backlog = collections.deque()
+        # Created on the event loop thread, so the event belongs to that loop.
+        self._ready = asyncio.Event()
+        self.metrics = metrics if metrics is not None else {}
+        self.metrics.setdefault('results_coalesced_total', 0)
+        self.metrics['result_backlog'] = 0
+
+    def put_threadsafe(self, response):
+        try:
+            self._loop.call_soon_threadsafe(self._put, response)
+        except RuntimeError:
+            # The event loop has already been closed.
+            pass
+
+    def _put(self, response):
+        if isinstance(response, RecognitionResult) and not response.is_final \
+                and self._backlog and isinstance(self._backlog[-1], RecognitionResult) and not self._backlog[-1].is_final:
+            self._backlog[-1] = response
+            self.metrics['results_coalesced_total'] += 1
+        else:
+            self._backlog.append(response)
+        self.metrics['result_backlog'] = len(self._backlog)
+        self._ready.set()
+
+    async def get(self):
+        while not self._backlog:
+            self._ready.clear()
+            await self._ready.wait()
+        response = self._backlog.popleft()
+        self.metrics['result_backlog'] = len(self._backlog)
+        return response
+
+
+async def pump_audio(audio, q):
+    """ Copies the audio async iterator into a thread queue read by an SDK. """
+    async for content in audio:
+        q.put(content)
+
+
+class SampleClock(object):
+    """ Maps positions in the audio, counted in samples since the microphone opened, to when they were captured. """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.samples = 0
+        self._marks = collections.deque(maxlen=CLOCK_HISTORY_SECS * 50)
+
+    def advance(self, content, captured):
+        """ Counts a chunk of 16 bit audio whose last sample was captured at the given time. """
+        self.samples += len(content) // 2
+        self._marks.append((self.samples, captured))
+        return self.samples
+
+    def captured(self, position):
+        """ Returns the time.monotonic() at which the sample at position was captured, or None if unknown. """
+        for end, captured in reversed(self._marks):
+            if end <= position:
+                return captured - (end - position) / self.sample_rate
+        return None
+
+
+class AudioTee(object):
+    """ Copies one audio async iterator to several outputs. The chunks are shared, not copied. """
+
+    def __init__(self, audio, count):
+        self._audio = audio
+        self.outputs = [AudioQueue(audio.clock) for i in range(count)]
+        for output in self.outputs:
+            output.position = audio.position
+        self._pump = asyncio.ensure_future(self.pump())
+
+    async def pump(self):
+        try:
+            async for content in self._audio:
+                for output in self.outputs:
+                    output.put_nowait(content, self._audio.position)
+        finally:
+            for output in self.outputs:
+                output.put_nowait(None)
+
+    def close(self):
+        self._pump.cancel()
+
+
+class AudioQueue(object):
+    """ Async iterator over queued audio chunks. Chunks waiting in the queue are joined. """
+
+    def __init__(self, clock=None):
+        self._queue = asyncio.Queue()
+        self.closed = False
+        self.clock = clock
+        # Sample clock position of the end of the audio returned so far.
+        self.position = 0
+
+    def put_nowait(self, content, position=None):
+        """ Queues a chunk of audio ending at the sample clock position. None ends the audio. """
+        if content is None:
+            self._queue.put_nowait(None)
+        else:
+            self._queue.put_nowait((content, position))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+
+        # Wait for at least one chunk of data, and stop iteration if the chunk
+        # is None, indicating the end of the audio stream.
+        item = await self._queue.get()
+        if item is None:
+            self.closed = True
+            raise StopAsyncIteration
+        audioData = [item[0]]
+        self.advance(item)
+
+        # Now consume whatever other data's still buffered.
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is None:
+                self.closed = True
+                break
+            audioData.append(item[0])
+            self.advance(item)
+
+        return b''.join(audioData)
+
+    def advance(self, item):
+        content, position = item
+        self.position = position if position is not None else self.position + len(content) // 2
@@ -0,0 +1,95 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module caches the transcripts of pieces of audio so that transcribing the same
+# recording again does not pay for the same audio twice. The key is a hash of the audio,
+# the service and the settings the service depends on. The transcripts are kept compressed
+# in one SQLite file and the least recently used are evicted when it grows too large.
+
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+
+from speakreader import logger
+
+RESULT_CACHE_FILENAME = 'resultcache.db'
+
+# Evicting stops when the cache is down to this fraction of its maximum size.
+EVICT_TO = 0.9
+
+
+class ResultCache(object):
+
+    def __init__(self, filename, max_bytes):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                         "(key BLOB PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self._db.commit()
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    @staticmethod
+    def key(content, sample_rate, recognizer):
+        """ Returns the fingerprint of a piece of audio transcribed by a recognizer with its current settings. """
+        digest = hashlib.sha256(content)
+        digest.update(("\0%s\0%s\0%s\0%r" % (sample_rate, recognizer.name, recognizer.language,
+                                               recognizer.configKey())).encode('utf-8'))
+        return digest.digest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def put(self, key, transcript):
+        value = zlib.compress(transcript.encode('utf-8'))
+        size = len(key) + len(value)
+        with self._lock:
+            old = self._db.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO results (key, value, size, used) VALUES (?, ?, ?, ?)",
+                             (key, value, size, time.time()))
+            self._size += size - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        target = self.max_bytes * EVICT_TO
+        evicted = 0
+        for key, size in self._db.execute("SELECT key, size FROM results ORDER BY used").fetchall():
+            if self._size <= target:
+                break
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._size -= size
+            evicted += 1
+        logger.debug("ResultCache: Evicted %d results" % evicted)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
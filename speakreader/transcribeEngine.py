@@ -19,14 +19,24 @@
 # to the queue manager.
 
 import threading
-import re
+import asyncio
 import os
 import datetime
+import time
 
 import speakreader
 from speakreader import logger
-from speakreader.microphoneStream import MicrophoneStream
+from speakreader.microphoneStream import MicrophoneStream, SAMPLERATE
 from speakreader.queueManager import QueueManager
+from speakreader.hedgedRecognizer import HedgedRecognizer
+from speakreader.latencyMonitor import LatencyMonitor
+from speakreader.transcriptIndex import TranscriptIndex
+from speakreader.transcriptWriter import TranscriptWriter
+from speakreader.transcriptStore import TranscriptStore, STORE_FILENAME
+from speakreader.wordMatcher import Censor
+from speakreader.postProcessor import PostProcessor
+from speakreader.keywordSpotter import KeywordSpotter
+from speakreader.outputSinks import createSinks
 
 try:
     from speakreader.googleTranscribe import googleTranscribe
@@ -46,17 +56,65 @@ try:
 except:
     MICROSOFT_SERVICE = False
 
+try:
+    from speakreader.voskTranscribe import voskTranscribe, is_supported as VOSK_SERVICE
+except:
+    VOSK_SERVICE = False
+
+from speakreader.fakeTranscribe import fakeTranscribe
+
+def recognizerClass(service):
+    """ Returns the recognizer class of a Speech-To-Text Service, or None if it is not supported. """
+    if service == 'google' and GOOGLE_SERVICE:
+        return googleTranscribe
+    elif service == 'IBM' and IBM_SERVICE:
+        return ibmTranscribe
+    elif service == 'microsoft' and MICROSOFT_SERVICE:
+        return microsoftTranscribe
+    elif service == 'vosk' and VOSK_SERVICE:
+        return voskTranscribe
+    elif service == 'fake':
+        return fakeTranscribe
+    return None
+
+
 FILENAME_PREFIX = "Transcript-"
 FILENAME_DATE_FORMAT = "%Y-%m-%d-%H%M"
 TRANSCRIPT_FILENAME_SUFFIX = "txt"
 RECORDING_FILENAME_SUFFIX = "wav"
 
+# Seconds the captions in other languages are given to finish after the audio ends.
+CHANNEL_CLOSE_SECS = 5
+
+# Seconds to wait before restarting the recognizer of a caption language that failed.
+CHANNEL_RESTART_SECS = 2
+
+
+class CaptionChannel(object):
+    """ The captions of one language: the handler of its listeners and its transcript. """
+
+    def __init__(self, language, handler):
+        self.language = language
+        self.handler = handler
+        self.queue = handler.getReceiverQueue()
+        self.file = None
+        self.name = None
+        self.index = None
+
 
 class TranscribeEngine:
 
     _INITIALIZED = False
     _transcribeThread = None
+    _transcribeFuture = None
     _ONLINE = False
+    _standbyService = None
+    _startTime = None
+    transcribeService = None
+    transcriptWriter = None
+    alertSinks = None
+    transcriptSinks = None
+    channels = ()
     _censor_char = "*"
     OFFLINE_MESSAGE = {"event": "transcript", "final": False, "record": "Transcription Engine is Offline"}
     ONLINE_MESSAGE = {"event": "transcript", "final": False, "record": "Welcome to SpeakReader -- Listening"}
@@ -74,38 +132,83 @@ class TranscribeEngine:
         self.GOOGLE_SERVICE = GOOGLE_SERVICE
         self.IBM_SERVICE = IBM_SERVICE
         self.MICROSOFT_SERVICE = MICROSOFT_SERVICE
+        self.VOSK_SERVICE = VOSK_SERVICE
+
+        # The censored words and the rules are compiled once and again only when they change.
+        self._censor = Censor(self._censor_char)
+        self.postProcess = PostProcessor()
+        self.keywordSpotter = KeywordSpotter()
 
         ###################################################################################################
         #  Initialize the Queue Manager
         ###################################################################################################
         self.queueManager = QueueManager()
-        self.transcriptQueue = self.queueManager.transcriptHandler.getReceiverQueue()
+        self.channel = CaptionChannel(None, self.queueManager.transcriptHandler)
+        self.transcriptQueue = self.channel.queue
+        self.alertQueue = self.queueManager.alertHandler.getReceiverQueue()
+        self.latencyMonitor = LatencyMonitor()
+        self.transcriptStore = TranscriptStore(os.path.join(speakreader.DATA_DIR, STORE_FILENAME))
+        self.queueManager.transcriptHandler.transcriptStore = self.transcriptStore
+
+        ###################################################################################################
+        #  Start the event loop. The speech-to-text clients live on it and are reused across restarts.
+        ###################################################################################################
+        self._loop = asyncio.new_event_loop()
+        self._recognizers = {}
+        self._transcribeThread = threading.Thread(name='TranscribeEngine', target=self.run)
+        self._transcribeThread.start()
 
         TranscribeEngine._INITIALIZED = True
 
     @property
     def is_online(self):
-        if self._transcribeThread is None or not self._transcribeThread.is_alive():
+        if self._transcribeFuture is None or self._transcribeFuture.done():
             self._ONLINE = False
         return self._ONLINE
 
-    def start(self):
-        self._transcribeThread = threading.Thread(name='TranscribeEngine', target=self.run)
-        self._transcribeThread.start()
+    def start(self, standbyService=None):
+        self._standbyService = standbyService
+        self._startTime = time.monotonic()
+        self._transcribeFuture = asyncio.run_coroutine_threadsafe(self.transcribe(), self._loop)
 
     def stop(self):
         if self._ONLINE:
             self._ONLINE = False
             self.microphoneStream.stop()
             self.transcriptQueue.put_nowait(self.OFFLINE_MESSAGE)
-            self._transcribeThread.join()
+            try:
+                self._transcribeFuture.result()
+            except Exception as e:
+                logger.error("Transcribe Engine Exception: %s" % e)
             self.queueManager.transcriptHandler.setFileName(None)
 
     def shutdown(self):
         self.stop()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._transcribeThread.join()
         self.queueManager.shutdown()
 
     def run(self):
+        # The transcribe engine and the speech-to-text services share one event loop.
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    def prewarm(self, services):
+        """ Creates the clients of the given services and connects them ahead of the next start. """
+        asyncio.run_coroutine_threadsafe(self.prewarmRecognizers(services), self._loop)
+
+    async def prewarmRecognizers(self, services):
+        for service in services:
+            if service:
+                try:
+                    await self.getRecognizer(service)
+                except Exception as e:
+                    logger.warn("Speech-To-Text Service %s failed to initialize: %s" % (service, e))
+
+    async def transcribe(self):
         if self._ONLINE:
             logger.warn("Transcribe Engine already Started")
             return
@@ -116,52 +219,230 @@ class TranscribeEngine:
         FILENAME_DATESTRING = datetime.datetime.now().strftime(FILENAME_DATE_FORMAT)
         TRANSCRIPT_FILENAME = FILENAME_PREFIX + FILENAME_DATESTRING + "." + TRANSCRIPT_FILENAME_SUFFIX
         RECORDING_FILENAME = FILENAME_PREFIX + FILENAME_DATESTRING + "." + RECORDING_FILENAME_SUFFIX
-        tf = os.path.join(speakreader.CONFIG.TRANSCRIPTS_FOLDER, TRANSCRIPT_FILENAME)
-        self.queueManager.transcriptHandler.setFileName(tf)
+
+        # The speech-to-text services connect while the microphone is being opened.
+        loop = asyncio.get_event_loop()
+        primary = asyncio.ensure_future(self.getRecognizer(speakreader.CONFIG.SPEECH_TO_TEXT_SERVICE))
+        standby = None
+        if self._standbyService and self._standbyService != speakreader.CONFIG.SPEECH_TO_TEXT_SERVICE:
+            standby = asyncio.ensure_future(self.getRecognizer(self._standbyService))
+        languages = {}
+        for language in self.captionLanguages():
+            languages[language] = asyncio.ensure_future(self.getRecognizer(speakreader.CONFIG.SPEECH_TO_TEXT_SERVICE, language))
 
         try:
-            self.microphoneStream = MicrophoneStream(speakreader.CONFIG.INPUT_DEVICE)
+            self.microphoneStream = await loop.run_in_executor(None, MicrophoneStream, speakreader.CONFIG.INPUT_DEVICE)
             self.microphoneStream.recordingFilename = RECORDING_FILENAME
             self.microphoneStream.meterQueue = self.queueManager.meterHandler.getReceiverQueue()
+            # Subscribe before opening so that the audio spoken while the services connect is kept.
+            # Every subscription is given the same chunks, so each language adds no copy of the audio.
+            audio = self.microphoneStream.subscribe()
+            subscriptions = {language: self.microphoneStream.subscribe() for language in languages}
+            await loop.run_in_executor(None, self.microphoneStream.__enter__)
         except Exception as e:
             logger.debug("MicrophoneStream Exception: %s" % e)
             self.transcriptQueue.put_nowait(self.OFFLINE_MESSAGE)
             return
 
-        if speakreader.CONFIG.SPEECH_TO_TEXT_SERVICE == 'google' and self.GOOGLE_SERVICE:
-            transcribeService = googleTranscribe(self.microphoneStream)
-        elif speakreader.CONFIG.SPEECH_TO_TEXT_SERVICE == 'IBM' and self.IBM_SERVICE:
-            transcribeService = ibmTranscribe(self.microphoneStream)
-        elif speakreader.CONFIG.SPEECH_TO_TEXT_SERVICE == 'microsoft' and self.MICROSOFT_SERVICE:
-            transcribeService = microsoftTranscribe(self.microphoneStream)
-        else:
+        try:
+            transcribeService = await primary
+        except Exception as e:
+            logger.warn("Speech-To-Text Service failed to initialize: %s" % e)
+            transcribeService = None
+        if transcribeService is None:
             logger.warn("No Supported Transcribe Service Selected. Can't start Transcribe Engine.")
+            self.microphoneStream.stop()
             return
 
-        self.transcriptFile = open(tf, "a+")
+        if standby is not None:
+            try:
+                standbyService = await standby
+            except Exception as e:
+                logger.warn("Standby Speech-To-Text Service failed to initialize: %s" % e)
+                standbyService = None
+            if standbyService is None:
+                logger.warn("Standby Speech-To-Text Service not available. Continuing without failover.")
+            else:
+                logger.info("Transcribe Engine using the %s Speech-To-Text Service as standby" % self._standbyService)
+                transcribeService = HedgedRecognizer(transcribeService, standbyService, self.latencyMonitor)
+
+        self.transcribeService = transcribeService
+
+        channels = []
+        for language, recognizer in languages.items():
+            try:
+                recognizer = await recognizer
+            except Exception as e:
+                logger.warn("Speech-To-Text Service failed to initialize for %s: %s" % (language, e))
+                recognizer = None
+            if recognizer is None:
+                self.microphoneStream.unsubscribe(subscriptions[language])
+                continue
+            channel = CaptionChannel(language, self.queueManager.addLanguage(language))
+            channels.append((channel, recognizer, subscriptions[language]))
+
+        # At most TRANSCRIPT_SYNC_SECS of finals are lost if the system goes down.
+        self.transcriptWriter = TranscriptWriter(speakreader.CONFIG.TRANSCRIPT_SYNC_SECS, self.latencyMonitor,
+                                                 self.transcriptStore)
+        recording = RECORDING_FILENAME if speakreader.CONFIG.SAVE_RECORDINGS else None
+        await self.openTranscript(self.channel, TRANSCRIPT_FILENAME, recording)
+        for channel, recognizer, subscription in channels:
+            name = FILENAME_PREFIX + FILENAME_DATESTRING + "." + channel.language + "." + TRANSCRIPT_FILENAME_SUFFIX
+            await self.openTranscript(channel, name, recording)
+            channel.queue.put_nowait(self.ONLINE_MESSAGE)
+        self.channels = [channel for channel, recognizer, subscription in channels]
+        # Captions and alerts are also sent to the UDP, named pipe and webhook sinks that are configured.
+        self.transcriptSinks = createSinks('transcript', speakreader.CONFIG.TRANSCRIPT_UDP_ADDRESS,
+                                           speakreader.CONFIG.TRANSCRIPT_PIPE, speakreader.CONFIG.TRANSCRIPT_WEBHOOK_URL)
+        self.alertSinks = createSinks('alert', speakreader.CONFIG.ALERT_UDP_ADDRESS,
+                                      speakreader.CONFIG.ALERT_PIPE, speakreader.CONFIG.ALERT_WEBHOOK_URL)
         self.transcriptQueue.put_nowait(self.ONLINE_MESSAGE)
         self._ONLINE = True
 
+        tasks = [asyncio.ensure_future(self.transcribeChannel(channel, recognizer, subscription))
+                 for channel, recognizer, subscription in channels]
         try:
-            with self.microphoneStream as stream:
-                while self._ONLINE:
-                    responses = transcribeService.transcribe()
-                    self.process_responses(responses)
-                logger.info("Transcription Engine Stream Closed")
+            while self._ONLINE and not self.microphoneStream.closed:
+                responses = transcribeService.recognize(audio)
+                await self.process_responses(responses, audio.clock)
+            logger.info("Transcription Engine Stream Closed")
         except Exception as e:
             logger.error(e)
+        finally:
+            self.microphoneStream.stop()
 
-        self.transcriptFile.close()
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=CHANNEL_CLOSE_SECS)
+            for task in pending:
+                task.cancel()
+        for channel in self.channels:
+            channel.queue.put_nowait(self.OFFLINE_MESSAGE)
+            channel.handler.setFileName(None)
+        self.channels = ()
+
+        self.transcriptWriter.close()
+        for sinks in (self.transcriptSinks, self.alertSinks):
+            if sinks is not None:
+                sinks.close()
+        self.transcriptSinks = self.alertSinks = None
         self.transcriptQueue.put_nowait(self.OFFLINE_MESSAGE)
         self._ONLINE = False
         logger.info("Transcribe Engine Terminated")
 
 
-    def process_responses(self, responses):
+    async def openTranscript(self, channel, name, recording):
+        """ Opens the transcript of a channel, adding to it if it exists. """
+        loop = asyncio.get_event_loop()
+        channel.name = name
+        channel.file = os.path.join(speakreader.CONFIG.TRANSCRIPTS_FOLDER, name)
+        # A transcript written before the store existed is imported before it is added to.
+        open(channel.file, "a").close()
+        await loop.run_in_executor(None, self.transcriptStore.importText, name, channel.file)
+        channel.index = TranscriptIndex(channel.file, recording, SAMPLERATE, self.microphoneStream.recordingOffset)
+        # The segments are numbered after those already in the store.
+        channel.index.segments = max(channel.index.segments,
+                                     await loop.run_in_executor(None, self.transcriptStore.nextSeq, name))
+        # The handler loads the transcript so far for its new listeners.
+        await loop.run_in_executor(None, channel.handler.setFileName, channel.file)
+
+    async def transcribeChannel(self, channel, recognizer, audio):
+        """ Transcribes the captions in another language until the audio ends, restarting the recognizer after errors. """
+        try:
+            while self._ONLINE and not audio.closed:
+                try:
+                    await self.process_responses(recognizer.recognize(audio), audio.clock, channel)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("Transcribe Engine captions in %s failed, restarting in %d seconds: %s"
+                                 % (channel.language, CHANNEL_RESTART_SECS, e))
+                    await asyncio.sleep(CHANNEL_RESTART_SECS)
+        finally:
+            # The audio of the channel is no longer queued once it is not read.
+            self.microphoneStream.unsubscribe(audio)
+
+    @staticmethod
+    def captionLanguages():
+        """ Returns the languages captioned besides the main one, if the service can be told the language. """
+        languages = []
+        for language in speakreader.CONFIG.CAPTION_LANGUAGES:
+            language = language.strip()
+            if language and language != speakreader.CONFIG.TRANSCRIPT_LANGUAGE and language not in languages:
+                languages.append(language)
+        serviceClass = recognizerClass(speakreader.CONFIG.SPEECH_TO_TEXT_SERVICE)
+        if languages and serviceClass is not None and not serviceClass.supports_language:
+            logger.warn("The %s Speech-To-Text Service can not caption other languages" % serviceClass.name)
+            return []
+        return languages
+
+    async def getRecognizer(self, service, language=None):
+        """ Returns the warmed up recognizer of a service. It is created again when its settings change. """
+        serviceClass = recognizerClass(service)
+        if serviceClass is None:
+            return None
+
+        key = serviceClass.configKey()
+        # The recognizer of the main language follows TRANSCRIPT_LANGUAGE.
+        cached = self._recognizers.get((service, language))
+        if language is None:
+            key = key + (speakreader.CONFIG.TRANSCRIPT_LANGUAGE,)
+        if cached is None or cached[0] != key:
+            cached = (key, asyncio.ensure_future(self.createRecognizer(serviceClass, language)))
+            self._recognizers[(service, language)] = cached
+        try:
+            return await asyncio.shield(cached[1])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Let the next start try again.
+            if self._recognizers.get((service, language)) is cached:
+                del self._recognizers[(service, language)]
+            raise
+
+    async def createRecognizer(self, serviceClass, language=None):
+        loop = asyncio.get_event_loop()
+        start = time.monotonic()
+        # Reading the credentials can block. The async clients are created on this loop when they are first used.
+        recognizer = await loop.run_in_executor(None, serviceClass, SAMPLERATE, language)
+        if language is not None:
+            # The results and the latency of each language are told apart by the provider name.
+            recognizer.name = '%s-%s' % (recognizer.name, language)
+        try:
+            await recognizer.warmup()
+        except Exception as e:
+            # The service reports the problem again when it is used.
+            logger.warn("%s Speech-To-Text Service warm up failed: %s" % (recognizer.name, e))
+        logger.debug("%s Speech-To-Text Service ready in %.2f seconds" % (recognizer.name, time.monotonic() - start))
+        return recognizer
+
+    def getServiceStatus(self):
+        if not self.is_online or self.transcribeService is None:
+            return None
+        status = {'name': self.transcribeService.name}
+        metrics = self.transcribeService.getMetrics()
+        if metrics:
+            status['metrics'] = metrics
+        if isinstance(self.transcribeService, HedgedRecognizer):
+            status['failover'] = self.transcribeService.getStatus()
+        if self.channels:
+            status['languages'] = [channel.language for channel in self.channels]
+        return status
+
+    def getMetrics(self):
+        """ Returns the latency histograms and the gauges of the services in the Prometheus text format. """
+        gauges = self.transcribeService.getMetrics() if self.is_online and self.transcribeService is not None else {}
+        if self.is_online and self.transcriptWriter is not None:
+            gauges['transcript_writer'] = self.transcriptWriter.getMetrics()
+        for sinks in (self.transcriptSinks, self.alertSinks):
+            if sinks is not None:
+                gauges.update(sinks.getMetrics())
+        return self.latencyMonitor.getMetrics(gauges)
+
+    async def process_responses(self, responses, clock=None, channel=None):
 
         """Iterates through server responses and prints them.
-        The responses passed is a generator that will block until a response
-        is provided by the server.
+        The responses passed is an async iterator of RecognitionResult that
+        waits until a response is provided by the server.
         Each response may contain multiple results, and each result may contain
         multiple alternatives; for details, see https://goo.gl/tjCPAU.  Here we
         print only the transcription for the top alternative of the top result.
@@ -171,39 +452,69 @@ class TranscribeEngine:
         final one, print a newline to preserve the finalized transcription.
         """
 
-        for response in responses:
+        # The captions in other languages only go to their listeners and their transcript.
+        if channel is None:
+            channel = self.channel
+        main = channel is self.channel
+
+        async for response in responses:
+
+            self.latencyMonitor.recordResult(response, clock)
+
+            if main and self._startTime is not None:
+                logger.info("Transcribe Engine time to first caption %.2f seconds" % (time.monotonic() - self._startTime))
+                self._startTime = None
 
-            if not response['is_final'] and not speakreader.CONFIG.SHOW_INTERIM_RESULTS:
+            if not response.is_final and not speakreader.CONFIG.SHOW_INTERIM_RESULTS:
                 continue
 
-            transcript = response['transcript']
+            # Vocabulary, casing and number rules are applied before anything else sees the text.
+            transcript = self.postProcess(response.transcript) if main else response.transcript
+
+            words = response.words
+
+            # Keywords are spotted in what was said, before it is censored, but published censored.
+            alerts = []
+            if main and speakreader.CONFIG.ALERT_KEYWORDS:
+                alerts = self.keywordSpotter.spot(transcript, response.is_final, response.provider)
 
             """ If there are any additionally defined censor words, censor the transcript """
-            if speakreader.CONFIG.ENABLE_CENSORSHIP and speakreader.CONFIG.CENSORED_WORDS:
+            if speakreader.CONFIG.ENABLE_CENSORSHIP:
                 transcript = self.censor(transcript)
+                if words:
+                    censored = self._censor.words([word for word, start, end in words])
+                    words = [(word, start, end) for word, (_, start, end) in zip(censored, words)]
+                for alert in alerts:
+                    alert.update(keyword=self.censor(alert['keyword']), transcript=transcript)
+
+            for alert in alerts:
+                self.alertQueue.put(alert)
+                if self.alertSinks is not None:
+                    self.alertSinks.put(alert)
 
             transcription = {
                 'event': 'transcript',
-                'final': response['is_final'],
+                'final': response.is_final,
                 'record': transcript,
             }
 
-            self.transcriptQueue.put(transcription)
+            channel.queue.put(transcription)
+            if main and self.transcriptSinks is not None:
+                self.transcriptSinks.put(dict(transcription, provider=response.provider, time_ms=int(time.time() * 1000)))
+            self.latencyMonitor.recordPipeline(response)
 
-            if response['is_final']:
-                self.transcriptFile.write(transcript.strip() + "\n\n")
-                self.transcriptFile.flush()
+            if response.is_final:
+                segment = channel.index.segment(transcript.strip(), response.audio_end, words, response.provider)
+                self.transcriptWriter.write([
+                    (channel.file, transcript.strip() + "\n\n"),
+                    channel.index.entry(segment),
+                ], (channel.name, segment))
 
 
     def censor(self, input_text):
         """Returns input_text with any defined words censored."""
-        res = input_text
-
-        for word in speakreader.CONFIG.CENSORED_WORDS:
-            if len(word) > 1:
-                regex_string = r'\b{0}\b'
-                regex_string = regex_string.format("(" + word[0] + ")" + word[1:len(word)])
-                regex = re.compile(regex_string, re.IGNORECASE)
-                res = regex.sub(r"\1" + self._censor_char * (len(word)-1), res)
+        return self._censor(input_text)
 
-        return res
+    def reloadCensoredWords(self):
+        """Reads the censored words again on the next caption, after they are saved."""
+        self._censor.reload()
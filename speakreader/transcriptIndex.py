@@ -0,0 +1,116 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module keeps an index next to each transcript with the position in the recording
+# of every final result and its words. Each line of the index is a JSON segment:
+#   {"segment": 0, "time": 1577872800.5, "provider": "google", "text": "...",
+#    "recording": "Transcript-....wav", "rate": 16000, "start": 1600, "end": 32000,
+#    "words": [["hello", 1600, 9600], ...]}
+# The positions are sample frames of the recording. The audio of a segment is read from
+# the recording through a memory map, so only the requested samples are copied.
+
+import json
+import mmap
+import os
+import struct
+import time
+
+INDEX_SUFFIX = ".idx"
+
+
+def indexFilename(transcript):
+    return os.path.splitext(transcript)[0] + INDEX_SUFFIX
+
+
+class TranscriptIndex(object):
+    """ Numbers the segments of a transcript and formats them for its index. """
+
+    def __init__(self, transcript, recording, sample_rate, offset=0):
+        self.filename = indexFilename(transcript)
+        # The recording file name, or None if the audio is not being saved.
+        self.recording = recording
+        self.sample_rate = sample_rate
+        # Recording frame of sample clock position 0.
+        self.offset = offset
+        self.segments = 0
+        if os.path.isfile(self.filename):
+            with open(self.filename) as f:
+                self.segments = sum(1 for line in f)
+        self._last_end = 0
+
+    def segment(self, text, audio_end, words=None, provider=None):
+        """ Returns the next segment. Without word times it starts where the previous one ended. """
+        words = words or []
+        start = words[0][1] if words else self._last_end
+        end = max(audio_end or start, words[-1][2] if words else start)
+        self._last_end = end
+
+        segment = {
+            'segment': self.segments,
+            'time': round(time.time(), 3),
+            'provider': provider,
+            'text': text,
+            'recording': self.recording,
+            'rate': self.sample_rate,
+            'start': self.offset + start,
+            'end': self.offset + end,
+            'words': [[word, self.offset + wordStart, self.offset + wordEnd] for word, wordStart, wordEnd in words],
+        }
+        self.segments += 1
+        return segment
+
+    def entry(self, segment):
+        """ Returns the (filename, line) to append for a segment. """
+        return self.filename, json.dumps(segment, separators=(',', ':')) + "\n"
+
+
+def wavLayout(data):
+    """ Returns the channels, sample width, sample rate, data offset and data size of a PCM WAV file. """
+    if data[0:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError("Not a WAV file")
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunkId, size = struct.unpack('<4sI', data[pos:pos + 8])
+        pos += 8
+        if chunkId == b'fmt ':
+            tag, channels, rate, byteRate, blockAlign, bits = struct.unpack('<HHIIHH', data[pos:pos + 16])
+            if tag != 1:
+                raise ValueError("Not a PCM WAV file")
+            fmt = (channels, bits // 8, rate)
+        elif chunkId == b'data':
+            if fmt is None:
+                raise ValueError("WAV file has no format chunk")
+            # The header of a recording still being written may not be up to date.
+            return fmt + (pos, min(size, len(data) - pos))
+        pos += size + (size & 1)
+    raise ValueError("WAV file has no data chunk")
+
+
+def wavHeader(channels, sampleWidth, sampleRate, size):
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + size, b'WAVE', b'fmt ', 16, 1, channels, sampleRate,
+                       sampleRate * channels * sampleWidth, channels * sampleWidth, sampleWidth * 8, b'data', size)
+
+
+def segmentAudio(recording, start, end):
+    """ Returns a WAV file of the frames from start to end of a recording. """
+    with open(recording, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        channels, sampleWidth, sampleRate, offset, size = wavLayout(data)
+        frame = channels * sampleWidth
+        first = offset + min(max(0, start) * frame, size)
+        last = offset + min(max(start, end) * frame, size)
+        audio = data[first:last]
+    return wavHeader(channels, sampleWidth, sampleRate, len(audio)) + audio
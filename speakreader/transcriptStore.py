@@ -0,0 +1,237 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module stores the final results of the transcripts as rows of a SQLite database
+# in WAL mode, so the transcript writer can append while the web server reads. Each row
+# is one segment: its sequence number in the transcript, the time it was written, its
+# position in the recording, the service that transcribed it, its text and its words.
+# Transcripts are looked up by name and sequence number or time through indexes.
+#
+# The .txt transcripts are still written as before. A transcript that only exists as a
+# .txt file is imported a paragraph per segment the first time it is read, or by the
+# backfill of the transcripts folder.
+#
+# The text of the segments is indexed for full-text search with FTS5. Triggers keep the
+# index up to date in the same transaction as the segments.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from speakreader import logger
+
+STORE_FILENAME = 'transcripts.db'
+
+_SEARCH_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5(
+        text, content='segments', content_rowid='rowid', tokenize='porter unicode61');
+    CREATE TRIGGER IF NOT EXISTS segments_ai AFTER INSERT ON segments BEGIN
+        INSERT INTO segments_fts (rowid, text) VALUES (new.rowid, new.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS segments_ad AFTER DELETE ON segments BEGIN
+        INSERT INTO segments_fts (segments_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS segments_au AFTER UPDATE ON segments BEGIN
+        INSERT INTO segments_fts (segments_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+        INSERT INTO segments_fts (rowid, text) VALUES (new.rowid, new.text);
+    END;
+"""
+
+# Search hits show this many tokens around the matching words.
+SNIPPET_TOKENS = 12
+
+_COLUMNS = ('seq', 'time', 'start_ms', 'end_ms', 'provider', 'text', 'recording', 'start', 'end', 'words')
+
+
+class TranscriptStore(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._local = threading.local()
+        db = self.connection()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS segments (
+                transcript TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                time REAL NOT NULL,
+                start_ms INTEGER,
+                end_ms INTEGER,
+                provider TEXT,
+                text TEXT NOT NULL,
+                recording TEXT,
+                start INTEGER,
+                "end" INTEGER,
+                words TEXT,
+                PRIMARY KEY (transcript, seq)
+            );
+            CREATE INDEX IF NOT EXISTS segments_time ON segments (transcript, start_ms);
+        """)
+        db.commit()
+        self.searchable = self.createSearchIndex(db)
+
+    @staticmethod
+    def createSearchIndex(db):
+        """ Creates the full-text index, indexing the segments already stored. Returns whether it is available. """
+        try:
+            exists = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'segments_fts'").fetchone()
+            db.executescript(_SEARCH_SCHEMA)
+            if not exists:
+                db.execute("INSERT INTO segments_fts (segments_fts) VALUES ('rebuild')")
+            db.commit()
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warn("TranscriptStore: Full-text search is not available: %s" % e)
+            return False
+
+    def connection(self):
+        """ Returns the connection of the calling thread. """
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.filename, timeout=10)
+            # In WAL mode a commit is not synced. The transcript writer syncs with checkpoint().
+            db.execute("PRAGMA synchronous=NORMAL")
+            # The delete trigger only fires for the rows replaced by INSERT OR REPLACE with this on.
+            db.execute("PRAGMA recursive_triggers=ON")
+        return db
+
+    @staticmethod
+    def row(transcript, segment):
+        rate = segment.get('rate') or 0
+        start, end = segment.get('start'), segment.get('end')
+        return (transcript, segment['segment'], segment.get('time') or time.time(),
+                int(start * 1000 / rate) if rate and start is not None else None,
+                int(end * 1000 / rate) if rate and end is not None else None,
+                segment.get('provider'), segment['text'], segment.get('recording'), start, end,
+                json.dumps(segment['words'], separators=(',', ':')) if segment.get('words') else None)
+
+    def add(self, segments):
+        """ Appends the (transcript, segment) pairs in one transaction. """
+        db = self.connection()
+        with db:
+            db.executemany('INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           [self.row(transcript, segment) for transcript, segment in segments])
+
+    def checkpoint(self):
+        """ Syncs the committed segments to the disk. """
+        self.connection().execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def has(self, transcript):
+        return self.connection().execute('SELECT 1 FROM segments WHERE transcript = ? LIMIT 1', (transcript,)).fetchone() is not None
+
+    def nextSeq(self, transcript):
+        row = self.connection().execute('SELECT MAX(seq) FROM segments WHERE transcript = ?', (transcript,)).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def segments(self, transcript, first=0, last=None):
+        """ Returns the segments from sequence number first to last. """
+        rows = self.connection().execute(
+            'SELECT %s FROM segments WHERE transcript = ? AND seq >= ? AND seq <= ? ORDER BY seq' % self._select(),
+            (transcript, first, last if last is not None else 2 ** 62))
+        return [self._segment(row) for row in rows]
+
+    def segmentsBetween(self, transcript, start_ms, end_ms):
+        """ Returns the segments that start within a time range of the recording. """
+        rows = self.connection().execute(
+            'SELECT %s FROM segments WHERE transcript = ? AND start_ms >= ? AND start_ms < ? ORDER BY start_ms' % self._select(),
+            (transcript, start_ms, end_ms))
+        return [self._segment(row) for row in rows]
+
+    def getSegment(self, transcript, seq):
+        segments = self.segments(transcript, seq, seq)
+        return segments[0] if segments else None
+
+    def texts(self, transcript):
+        return [row[0] for row in self.connection().execute(
+            'SELECT text FROM segments WHERE transcript = ? ORDER BY seq', (transcript,))]
+
+    def exportText(self, transcript):
+        """ Returns the transcript in the format of the .txt files. """
+        return ''.join(text + "\n\n" for text in self.texts(transcript))
+
+    def delete(self, transcript):
+        db = self.connection()
+        with db:
+            db.execute('DELETE FROM segments WHERE transcript = ?', (transcript,))
+
+    def importText(self, transcript, filename):
+        """ Imports a .txt transcript that is not in the store yet. Returns whether the store has it. """
+        if self.has(transcript):
+            return True
+        if not os.path.isfile(filename):
+            return False
+        with open(filename) as f:
+            paragraphs = [p for p in f.read().rstrip("\n").split("\n\n") if p]
+        if not paragraphs:
+            return False
+        created = os.path.getmtime(filename)
+        self.add([(transcript, {'segment': seq, 'text': text, 'time': created}) for seq, text in enumerate(paragraphs)])
+        logger.info("TranscriptStore: Imported %d segments of %s" % (len(paragraphs), transcript))
+        return True
+
+    def backfill(self, folder):
+        """ Imports the .txt transcripts of a folder that are not in the store yet. Returns how many were. """
+        imported = 0
+        with os.scandir(path=folder) as files:
+            names = sorted(file.name for file in files if file.name.endswith('.txt') and file.is_file())
+        for name in names:
+            if self.has(name):
+                continue
+            try:
+                if self.importText(name, os.path.join(folder, name)):
+                    imported += 1
+            except (OSError, UnicodeDecodeError, sqlite3.Error) as e:
+                logger.warn("TranscriptStore: Unable to import %s: %s" % (name, e))
+        return imported
+
+    def search(self, query, limit=50):
+        """ Returns the segments matching all the words of the query, best first. """
+        match = self.matchExpression(query)
+        if not match:
+            return []
+        rows = self.connection().execute(
+            "SELECT s.transcript, s.seq, s.time, s.start_ms, s.end_ms, s.provider, "
+            "snippet(segments_fts, 0, '<b>', '</b>', '...', ?), bm25(segments_fts) "
+            "FROM segments_fts JOIN segments s ON s.rowid = segments_fts.rowid "
+            "WHERE segments_fts MATCH ? ORDER BY rank LIMIT ?", (SNIPPET_TOKENS, match, limit))
+        return [{
+            'transcript': transcript,
+            'segment': seq,
+            'time_ms': int(created * 1000),
+            'start_ms': start_ms,
+            'end_ms': end_ms,
+            'provider': provider,
+            'snippet': snippet,
+            'score': round(-score, 3),
+        } for transcript, seq, created, start_ms, end_ms, provider, snippet, score in rows]
+
+    @staticmethod
+    def matchExpression(query):
+        """ Returns an FTS5 query for the words of a search, each quoted so that no word is taken as syntax. """
+        words = [word.replace('"', '') for word in (query or '').split()]
+        return ' '.join('"%s"' % word for word in words if word)
+
+    @staticmethod
+    def _select():
+        return ', '.join('"%s"' % column for column in _COLUMNS)
+
+    @staticmethod
+    def _segment(row):
+        segment = dict(zip(_COLUMNS, row))
+        segment['words'] = json.loads(segment['words']) if segment['words'] else []
+        return segment
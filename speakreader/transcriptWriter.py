@@ -0,0 +1,148 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module saves the transcript on a thread of its own so that slow storage does not
+# hold up the captions. The finals waiting when the thread wakes are appended together
+# and handed to the OS at once, so new listeners see them in the transcript file. They
+# are synced to the disk together no later than sync_secs after the oldest was written,
+# which bounds what a power loss or OS crash can take. Their segments are added to the
+# transcript store in one transaction per batch.
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from speakreader import logger
+
+
+class TranscriptWriter(object):
+    """ Appends text to files and syncs them in groups. """
+
+    def __init__(self, sync_secs, latencyMonitor=None, store=None):
+        self.sync_secs = max(0.0, sync_secs)
+        # The TranscriptStore the segments of the finals are added to.
+        self.store = store
+        # Records the time from the hand-off of each final to its sync to the disk.
+        self.latencyMonitor = latencyMonitor
+        # Gauges shown in the metrics. The names end with their unit.
+        self.metrics = {'pending_finals': 0, 'batch_finals': 0, 'fsync_seconds': 0.0}
+        self._queue = queue.Queue()
+        self._files = {}
+        self._thread = threading.Thread(name='TranscriptWriter', target=self.run)
+        self._thread.start()
+
+    def write(self, entries, segment=None):
+        """ Queues the (filename, text) appends of one final, and its (transcript, segment) for the store. """
+        self._queue.put((time.monotonic(), entries, segment))
+
+    def close(self):
+        """ Writes and syncs everything queued, then closes the files. """
+        self._queue.put(None)
+        self._thread.join()
+
+    def run(self):
+        unsynced = []
+        dirty = set()
+        closing = False
+        while not closing:
+            timeout = None
+            if unsynced:
+                timeout = max(0.0, unsynced[0] + self.sync_secs - time.monotonic())
+            try:
+                batch = [self._queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            finals = 0
+            segments = []
+            for item in batch:
+                if item is None:
+                    closing = True
+                    continue
+                queued, entries, segment = item
+                if segment is not None:
+                    segments.append(segment)
+                for filename, text in entries:
+                    try:
+                        self.file(filename).write(text)
+                        dirty.add(filename)
+                    except OSError as e:
+                        logger.error("TranscriptWriter: Unable to write %s: %s" % (os.path.basename(filename), e))
+                unsynced.append(queued)
+                finals += 1
+
+            for filename in dirty:
+                self.flush(filename)
+            if segments and self.store is not None:
+                try:
+                    self.store.add(segments)
+                except sqlite3.Error as e:
+                    logger.error("TranscriptWriter: Unable to store %d segments: %s" % (len(segments), e))
+            if finals:
+                self.metrics['batch_finals'] = finals
+
+            if unsynced and (closing or time.monotonic() - unsynced[0] >= self.sync_secs):
+                start = time.monotonic()
+                for filename in dirty:
+                    self.sync(filename)
+                if self.store is not None:
+                    self.checkpoint()
+                now = time.monotonic()
+                self.metrics['fsync_seconds'] = round(now - start, 4)
+                if self.latencyMonitor is not None:
+                    for queued in unsynced:
+                        self.latencyMonitor.recordStorage(now - queued)
+                unsynced = []
+                dirty = set()
+            self.metrics['pending_finals'] = len(unsynced)
+
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def file(self, filename):
+        f = self._files.get(filename)
+        if f is None:
+            f = self._files[filename] = open(filename, "a")
+        return f
+
+    def flush(self, filename):
+        try:
+            self._files[filename].flush()
+        except OSError as e:
+            logger.error("TranscriptWriter: Unable to write %s: %s" % (os.path.basename(filename), e))
+
+    def sync(self, filename):
+        try:
+            os.fsync(self._files[filename].fileno())
+        except OSError as e:
+            logger.error("TranscriptWriter: Unable to sync %s: %s" % (os.path.basename(filename), e))
+
+    def checkpoint(self):
+        try:
+            self.store.checkpoint()
+        except sqlite3.Error as e:
+            logger.error("TranscriptWriter: Unable to sync the transcript store: %s" % e)
+
+    def getMetrics(self):
+        return dict(self.metrics)
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import speakreader
+from speakreader import logger
+from speakreader.recognizer import Recognizer
+
+try:
+    from vosk import Model, KaldiRecognizer, SetLogLevel
+    SetLogLevel(-1)
+    is_supported = True
+except ImportError:
+    is_supported = False
+
+# The model is fed audio in frames of this many samples.
+FRAME_SAMPLES = 4000
+
+# Seconds of silence decoded at startup to measure the real-time factor.
+RTF_PROBE_SECS = 2
+
+# Loaded models by path. Loading a model takes several seconds.
+_models = {}
+
+
+class voskTranscribe(Recognizer):
+
+    name = 'vosk'
+    # The language is the one of the model.
+    supports_language = False
+
+    def __init__(self, sample_rate, language=None):
+        super().__init__(sample_rate, language)
+        self.is_supported = is_supported
+        if not self.is_supported:
+            return
+
+        self._frame_bytes = FRAME_SAMPLES * 2
+
+        # The recognizer is not thread safe. All decoding runs on one worker thread.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._decode_time = 0.0
+        self._audio_time = 0.0
+
+        self.model_path = speakreader.CONFIG.VOSK_MODEL_PATH
+        self.model = None
+
+    @staticmethod
+    def configKey():
+        return (speakreader.CONFIG.VOSK_MODEL_PATH,)
+
+    async def warmup(self):
+        if not self.is_supported or self.model is not None:
+            return
+        self.model = await asyncio.get_event_loop().run_in_executor(self._executor, self.loadModel, self.model_path)
+
+    def loadModel(self, path):
+        model = _models.get(path)
+        if model is not None:
+            return model
+
+        start = time.perf_counter()
+        model = Model(path)
+        logger.info("voskTranscribe: Model loaded in %.2f seconds" % (time.perf_counter() - start))
+
+        recognizer = KaldiRecognizer(model, self.sample_rate)
+        silence = bytes(self._bytes_per_second * RTF_PROBE_SECS)
+        start = time.perf_counter()
+        for i in range(0, len(silence), self._frame_bytes):
+            recognizer.AcceptWaveform(silence[i:i + self._frame_bytes])
+        recognizer.FinalResult()
+        logger.info("voskTranscribe: Real-time factor %.2f" % ((time.perf_counter() - start) / RTF_PROBE_SECS))
+
+        _models[path] = model
+        return model
+
+    async def recognize(self, audio):
+        if not self.is_supported:
+            return
+        # Async generator to return transcription results
+        logger.debug("voskTranscribe.recognize ENTER")
+
+        loop = asyncio.get_event_loop()
+        self.startStream(audio)
+        await self.warmup()
+        recognizer = KaldiRecognizer(self.model, self.sample_rate)
+        # The final results include the times of their words.
+        recognizer.SetWords(True)
+        self._decode_time = 0.0
+        self._audio_time = 0.0
+
+        pending = b''
+        partial = ''
+
+        async for content in audio:
+            pending += content
+            size = len(pending) - len(pending) % self._frame_bytes
+            if size == 0:
+                continue
+            frames, pending = pending[:size], pending[size:]
+
+            results = await loop.run_in_executor(self._executor, self.decode, recognizer, frames)
+            for transcript, is_final, audio_end, words in results:
+                if is_final:
+                    partial = ''
+                elif transcript == partial:
+                    continue
+                else:
+                    partial = transcript
+                yield self.result(transcript, is_final, audio_end=audio_end, words=words)
+
+        results = await loop.run_in_executor(self._executor, self.flush, recognizer, pending)
+        for transcript, is_final, audio_end, words in results:
+            yield self.result(transcript, is_final, audio_end=audio_end, words=words)
+
+        if self._audio_time > 0:
+            logger.info("voskTranscribe: Real-time factor %.2f over %.0f seconds of audio"
+                        % (self._decode_time / self._audio_time, self._audio_time))
+        logger.debug("voskTranscribe.recognize EXIT")
+
+    def decode(self, recognizer, frames):
+        """ Feeds whole frames to the recognizer. Runs on the decode thread. """
+        results = []
+        start = time.perf_counter()
+        for i in range(0, len(frames), self._frame_bytes):
+            audio_end = self.streamPosition(self._audio_time + (i + self._frame_bytes) / self._bytes_per_second)
+            if recognizer.AcceptWaveform(frames[i:i + self._frame_bytes]):
+                result = json.loads(recognizer.Result())
+                if result.get('text'):
+                    results.append((result['text'], True, audio_end, self.words(result)))
+            elif speakreader.CONFIG.SHOW_INTERIM_RESULTS:
+                transcript = json.loads(recognizer.PartialResult()).get('partial', '')
+                if transcript:
+                    results.append((transcript, False, audio_end, None))
+        self._decode_time += time.perf_counter() - start
+        self._audio_time += len(frames) / self._bytes_per_second
+        return results
+
+    def flush(self, recognizer, frames):
+        """ Feeds the remaining audio and returns the last final result. """
+        if frames:
+            recognizer.AcceptWaveform(frames)
+        audio_end = self.streamPosition(self._audio_time + len(frames) / self._bytes_per_second)
+        result = json.loads(recognizer.FinalResult())
+        return [(result['text'], True, audio_end, self.words(result))] if result.get('text') else []
+
+    def words(self, result):
+        return self.wordTimes([(word['word'], word['start'], word['end']) for word in result.get('result', [])]) or None
@@ -17,6 +17,7 @@
 # This module contains the handlers for the web interface.
 
 import os
+import io
 import json
 import datetime
 import time
@@ -24,7 +25,7 @@ import queue
 from urllib.parse import urlparse
 
 import cherrypy
-from cherrypy.lib.static import serve_download
+from cherrypy.lib.static import serve_download, serve_fileobj
 
 from mako.lookup import TemplateLookup
 from mako import exceptions
@@ -33,6 +34,8 @@ from passlib.hash import pbkdf2_sha256
 import speakreader
 from speakreader import logger
 from speakreader.webauth import AuthController, requireAuth, is_admin
+from speakreader.transcriptIndex import INDEX_SUFFIX, indexFilename, segmentAudio
+from speakreader.queueManager import CLOSE_FRAME, ListenerOverrun
 
 
 def checked(variable):
@@ -96,6 +99,7 @@ class WebInterface(object):
             "google_service": self.SR.transcribeEngine.GOOGLE_SERVICE,
             "ibm_service": self.SR.transcribeEngine.IBM_SERVICE,
             "microsoft_service": self.SR.transcribeEngine.MICROSOFT_SERVICE,
+            "vosk_service": self.SR.transcribeEngine.VOSK_SERVICE,
         }
         settings = self.getSettings()
         return serve_template(templatename="manage.html", title="Management Console", productInfo=productInfo, config=settings['config'])
@@ -120,13 +124,16 @@ class WebInterface(object):
             "https_cert_chain": speakreader.CONFIG.HTTPS_CERT_CHAIN,
             "https_key": speakreader.CONFIG.HTTPS_KEY,
             "speech_to_text_service": speakreader.CONFIG.SPEECH_TO_TEXT_SERVICE,
+            "speech_to_text_standby_service": speakreader.CONFIG.SPEECH_TO_TEXT_STANDBY_SERVICE,
             "google_credentials_file": speakreader.CONFIG.GOOGLE_CREDENTIALS_FILE,
             "ibm_credentials_file": speakreader.CONFIG.IBM_CREDENTIALS_FILE,
             "microsoft_service_apikey": speakreader.CONFIG.MICROSOFT_SERVICE_APIKEY,
             "microsoft_service_region": speakreader.CONFIG.MICROSOFT_SERVICE_REGION,
+            "vosk_model_path": speakreader.CONFIG.VOSK_MODEL_PATH,
             "show_interim_results": speakreader.CONFIG.SHOW_INTERIM_RESULTS,
             "enable_censorship": speakreader.CONFIG.ENABLE_CENSORSHIP,
             "censored_words": '\r\n'.join(speakreader.CONFIG.CENSORED_WORDS),
+            "alert_keywords": '\r\n'.join(speakreader.CONFIG.ALERT_KEYWORDS),
             "http_basic_auth": speakreader.CONFIG.HTTP_BASIC_AUTH,
             "http_username": speakreader.CONFIG.HTTP_USERNAME,
             "http_hash_password": speakreader.CONFIG.HTTP_HASH_PASSWORD,
@@ -182,10 +189,12 @@ class WebInterface(object):
             kwargs['ibm_credentials_file'] = os.path.join(speakreader.DATA_DIR, upload_ibm_credentials_file.filename)
 
         if kwargs.get('speech_to_text_service') != speakreader.CONFIG.SPEECH_TO_TEXT_SERVICE \
+        or kwargs.get('speech_to_text_standby_service') != speakreader.CONFIG.SPEECH_TO_TEXT_STANDBY_SERVICE \
         or kwargs.get('google_credentials_file') != speakreader.CONFIG.GOOGLE_CREDENTIALS_FILE \
         or kwargs.get('ibm_credentials_file') != speakreader.CONFIG.IBM_CREDENTIALS_FILE \
         or kwargs.get('microsoft_service_apikey') != speakreader.CONFIG.MICROSOFT_SERVICE_APIKEY \
         or kwargs.get('microsoft_service_region') != speakreader.CONFIG.MICROSOFT_SERVICE_REGION \
+        or kwargs.get('vosk_model_path') != speakreader.CONFIG.VOSK_MODEL_PATH \
         or kwargs.get('enable_censorship') != speakreader.CONFIG.ENABLE_CENSORSHIP \
         or kwargs.get('input_device') != speakreader.CONFIG.INPUT_DEVICE \
         or kwargs.get('save_recordings') != speakreader.CONFIG.SAVE_RECORDINGS:
@@ -205,6 +214,10 @@ class WebInterface(object):
         while ("" in kwargs['censored_words']):
             kwargs['censored_words'].remove("")
 
+        kwargs['alert_keywords'] = kwargs.get('alert_keywords', '').rstrip('\r\n').replace('\r\n', ',').split(',')
+        while ("" in kwargs['alert_keywords']):
+            kwargs['alert_keywords'].remove("")
+
         set_http_password = int(kwargs.pop('set_http_password', 0))
         if kwargs.get('http_username') == "":
             kwargs['http_password'] = ""
@@ -228,6 +241,7 @@ class WebInterface(object):
 
         speakreader.CONFIG.process_kwargs(kwargs)
         speakreader.CONFIG.write()
+        self.SR.transcribeEngine.reloadCensoredWords()
 
         if cleanup:
             self.SR.cleanup_files()
@@ -239,6 +253,8 @@ class WebInterface(object):
         if restartTranscribeEngine and self.SR.transcribeEngine.is_online:
             self.SR.stopTranscribeEngine()
             self.SR.startTranscribeEngine()
+        elif restartTranscribeEngine:
+            self.SR.prewarmTranscribeEngine()
 
         return {'result': 'success',
                 'google_credentials_file': kwargs['google_credentials_file'],
@@ -361,27 +377,66 @@ class WebInterface(object):
         def eventSource(type, listenerQueue, remoteIP, sessionID):
             while self.SR.transcribeEngine.queueManager.is_initialized:
                 try:
-                    data = listenerQueue.get(timeout=2)
-                    if data is None:
-                        close_event = json.dumps({"event": "close"})
-                        yield 'data: {}\n\n'.format(close_event)
+                    # The frames are encoded once for all the listeners.
+                    frame = listenerQueue.get(timeout=2)
+                    if frame is None:
+                        yield CLOSE_FRAME
                         break
-                    yield 'data: {}\n\n'.format(json.dumps(data))
+                    yield frame
                 except queue.Empty:
                     continue
+                except ListenerOverrun:
+                    # Ended without a close event, so the browser reconnects and is sent the file so far.
+                    break
             logger.debug("Exiting " + type.capitalize() + " Listener loop for IP: " + remoteIP + " with sessionID: " + sessionID)
 
-        listenerQueue = self.SR.transcribeEngine.queueManager.addListener(type=type, remoteIP=remoteIP, sessionID=sessionID)
-
+        # lang selects the captions in one of the CAPTION_LANGUAGES, like /listen?lang=es
+        lang = kwargs.get('lang', None)
+        # A reconnecting browser sends the id of the last event it received. The EventSource
+        # polyfill sends it as a parameter.
+        lastEventId = cherrypy.request.headers.get('Last-Event-ID') or kwargs.get('evs_last_event_id')
+        status = None
         if type == 'transcript':
             if self.SR.transcribeEngine.is_online:
-                listenerQueue.put_nowait(self.SR.transcribeEngine.ONLINE_MESSAGE)
+                status = self.SR.transcribeEngine.ONLINE_MESSAGE
             else:
-                listenerQueue.put_nowait(self.SR.transcribeEngine.OFFLINE_MESSAGE)
+                status = self.SR.transcribeEngine.OFFLINE_MESSAGE
+
+        # etag is that of the transcriptSnapshot the page already shows, if any.
+        listenerQueue = self.SR.transcribeEngine.queueManager.addListener(type=type, remoteIP=remoteIP, sessionID=sessionID, lang=lang,
+                                                                          lastEventId=lastEventId, status=status,
+                                                                          etag=kwargs.get('etag'))
+        if listenerQueue is None and lang:
+            raise cherrypy.HTTPError(404, "No captions in %s" % lang)
 
         return eventSource(type, listenerQueue, remoteIP, sessionID)
     addListener._cp_config = {'response.stream': True}
 
+    @cherrypy.expose
+    def transcriptSnapshot(self, lang=None, **kwargs):
+        """ Returns the HTML of the transcript so far, or 304 if the browser has it already. """
+        queueManager = self.SR.transcribeEngine.queueManager
+        handler = queueManager.languageHandler(lang) if lang else queueManager.transcriptHandler
+        rendering = handler.snapshot.render() if handler is not None else None
+        if rendering is None:
+            raise cherrypy.HTTPError(404, "No transcript")
+
+        cherrypy.response.headers['ETag'] = rendering.etag
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        cherrypy.response.headers['Vary'] = 'Accept-Encoding'
+        ifNoneMatch = cherrypy.request.headers.get('If-None-Match', '')
+        if rendering.etag in [etag.strip() for etag in ifNoneMatch.split(',')]:
+            cherrypy.response.status = 304
+            return b''
+
+        cherrypy.response.headers['Content-Type'] = 'text/html;charset=utf-8'
+        if 'gzip' in cherrypy.request.headers.get('Accept-Encoding', ''):
+            # Compressed once for every listener, rather than by the gzip tool for each one.
+            cherrypy.response.headers['Content-Encoding'] = 'gzip'
+            return rendering.gzipped
+        return rendering.html
+    transcriptSnapshot._cp_config = {'tools.gzip.on': False}
+
     @cherrypy.expose
     @requireAuth(is_admin())
     def transcribeEngineStatus(self, **kwargs):
@@ -391,7 +446,10 @@ class WebInterface(object):
             while self.SR.is_initialized:
                 status = {}
                 status['status'] = self.SR.transcribeEngine.is_online
+                status['service'] = self.SR.transcribeEngine.getServiceStatus()
                 status['usage'] = self.SR.transcribeEngine.queueManager.getUsage()
+                status['latency'] = self.SR.transcribeEngine.latencyMonitor.getStatus()
+                status['batch'] = self.SR.getBatchStatus()
                 yield 'data: {}\n\n'.format(json.dumps(status))
                 time.sleep(1.5)
             yield 'data: {}\n\n'.format('Close')
@@ -399,6 +457,12 @@ class WebInterface(object):
         return eventSource()
     transcribeEngineStatus._cp_config = {'response.stream': True}
 
+    @cherrypy.expose
+    @requireAuth(is_admin())
+    def metrics(self, **kwargs):
+        cherrypy.response.headers["Content-Type"] = "text/plain; version=0.0.4;charset=utf-8"
+        return self.SR.transcribeEngine.getMetrics()
+
 
     ###################################################################################################
     #  Helper Routines
@@ -451,11 +515,30 @@ class WebInterface(object):
         fileList = []
         with os.scandir(path=path) as files:
             for file in files:
+                if file.name.endswith(INDEX_SUFFIX):
+                    continue
                 file_info = file.stat()
-                fileList.append({"name": file.name,
-                                 "created": datetime.datetime.fromtimestamp(file_info.st_ctime).strftime('%b %d, %Y %I:%M %p')})
+                fileInfo = {"name": file.name,
+                            "created": datetime.datetime.fromtimestamp(file_info.st_ctime).strftime('%b %d, %Y %I:%M %p')}
+                if kwargs.get('list') == 'transcripts':
+                    recording = os.path.splitext(file.name)[0] + ".wav"
+                    if os.path.isfile(os.path.join(speakreader.CONFIG.RECORDINGS_FOLDER, recording)):
+                        fileInfo["recording"] = recording
+                fileList.append(fileInfo)
         return {"data": fileList}
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(is_admin())
+    def batchTranscribe(self, recording=None, service=None, **kwargs):
+        if not recording:
+            return {"result": "error", "message": "No recording selected."}
+        message = self.SR.startBatchTranscription(recording, service=service)
+        if message is not None:
+            logger.warn(message)
+            return {"result": "error", "message": message}
+        return {"result": "success"}
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     @requireAuth(is_admin())
@@ -466,15 +549,76 @@ class WebInterface(object):
                 data = '<p>' + f.read().replace("\n", "</p><p>") + '</p>'
 
         elif kwargs.get('transcript'):
-            file = os.path.join(speakreader.CONFIG.TRANSCRIPTS_FOLDER, kwargs['transcript'])
-            with open(file) as f:
-                data = "<p>" + f.read().rstrip("\n\n").replace("\n\n", "</p><p>") + "</p>"
+            name = os.path.basename(kwargs['transcript'])
+            file = os.path.join(speakreader.CONFIG.TRANSCRIPTS_FOLDER, name)
+            store = self.SR.transcribeEngine.transcriptStore
+            if store.importText(name, file):
+                data = "<p>" + "</p><p>".join(store.texts(name)) + "</p>"
+            else:
+                with open(file) as f:
+                    data = "<p>" + f.read().rstrip("\n\n").replace("\n\n", "</p><p>") + "</p>"
         else:
             return {"result": "error"}
 
         return {"result": "success", "data": data}
 
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(is_admin())
+    def get_transcript_segments(self, transcript=None, first=0, last=None, **kwargs):
+        """ Returns the segments of a transcript with the recording positions of their words. """
+        if not transcript:
+            return {"result": "error", "message": "No transcript selected."}
+        name = os.path.basename(transcript)
+        store = self.SR.transcribeEngine.transcriptStore
+        store.importText(name, os.path.join(speakreader.CONFIG.TRANSCRIPTS_FOLDER, name))
+        try:
+            segments = store.segments(name, int(first), int(last) if last else None)
+        except ValueError:
+            return {"result": "error", "message": "Invalid segment range."}
+        return {"result": "success", "data": segments}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(is_admin())
+    def search_transcripts(self, q=None, limit=50, **kwargs):
+        """ Returns the transcript segments matching the words of a search, best first. """
+        store = self.SR.transcribeEngine.transcriptStore
+        if not store.searchable:
+            return {"result": "error", "message": "Transcript search is not available."}
+        try:
+            limit = min(max(int(limit), 1), 500)
+        except ValueError:
+            limit = 50
+        return {"result": "success", "data": store.search(q, limit)}
+
+    @cherrypy.expose
+    @requireAuth(is_admin())
+    def segment_audio(self, transcript=None, segment=None, **kwargs):
+        """ Returns the audio of a transcript segment as a WAV file. """
+        try:
+            segment = int(segment)
+        except (TypeError, ValueError):
+            raise cherrypy.HTTPError(400, "No segment selected.")
+        name = os.path.basename(transcript or '')
+        found = self.SR.transcribeEngine.transcriptStore.getSegment(name, segment)
+        if found is None or not found.get('recording') or found.get('start') is None:
+            raise cherrypy.HTTPError(404, "Segment not found.")
+
+        recording = os.path.join(speakreader.CONFIG.RECORDINGS_FOLDER, found['recording'])
+        if not os.path.isfile(recording):
+            raise cherrypy.HTTPError(404, "Recording %s not found." % found['recording'])
+        try:
+            data = segmentAudio(recording, found['start'], found['end'])
+        except ValueError as e:
+            raise cherrypy.HTTPError(500, str(e))
+
+        cherrypy.response.headers['Content-Type'] = 'audio/wav'
+        cherrypy.response.headers['Content-Disposition'] = 'inline; filename="%s-%d.wav"' \
+            % (os.path.splitext(name)[0], segment)
+        return data
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     @requireAuth(is_admin())
@@ -488,6 +632,10 @@ class WebInterface(object):
 
         if os.path.exists(file):
             os.remove(file)
+        if kwargs.get('transcript'):
+            if os.path.exists(indexFilename(file)):
+                os.remove(indexFilename(file))
+            self.SR.transcribeEngine.transcriptStore.delete(os.path.basename(kwargs['transcript']))
         return {"result": "success"}
 
     @cherrypy.expose
@@ -501,6 +649,11 @@ class WebInterface(object):
         elif kwargs.get('transcript'):
             path = speakreader.CONFIG.TRANSCRIPTS_FOLDER
             file = kwargs['transcript']
+            # The stored transcript is exported in the format of the .txt files.
+            store = self.SR.transcribeEngine.transcriptStore
+            if store.importText(os.path.basename(file), os.path.join(path, file)):
+                return serve_fileobj(io.BytesIO(store.exportText(os.path.basename(file)).encode('utf-8')), content_type='text/plain',
+                                     disposition='attachment', name=file)
         else:
             return
 
@@ -0,0 +1,126 @@
+# **************************************************************************************
+# * This file is part of SpeakReader.
+# *
+# *  SpeakReader is free software: you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License V3 as published by
+# *  the Free Software Foundation.
+# *
+# *  SpeakReader is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with SpeakReader.  If not, see <http://www.gnu.org/licenses/gpl-3.0.html>.
+# **************************************************************************************
+
+# This module finds whole words from a list in a text. The list is compiled once into a
+# single regular expression shaped like a trie, so the text is scanned once no matter how
+# many words there are, and words sharing a prefix are only tried once.
+
+import re
+import threading
+import time
+
+import speakreader
+
+_END = ''
+
+# Seconds between checks of the censored words for changes made outside the settings page.
+CHECK_SECS = 5
+
+
+def triePattern(words):
+    """ Returns a regular expression matching any of the words. """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[_END] = {}
+    return _nodePattern(trie)
+
+
+def _nodePattern(node):
+    optional = _END in node
+    branches = []
+    for char in sorted(c for c in node if c != _END):
+        branches.append(re.escape(char) + _nodePattern(node[char]))
+    if not branches:
+        return ''
+
+    if len(branches) == 1:
+        pattern = branches[0]
+        # A single character needs no group to be made optional.
+        if optional and len(pattern) > (2 if pattern.startswith('\\') else 1):
+            pattern = '(?:%s)' % pattern
+    else:
+        pattern = '(?:%s)' % '|'.join(branches)
+    return pattern + '?' if optional else pattern
+
+
+class WordMatcher(object):
+    """ Matches whole words or phrases of a list, ignoring case. """
+
+    def __init__(self, words):
+        self.words = tuple(words)
+        keys = {word.lower() for word in self.words if word}
+        # Lookarounds instead of \b so that words may begin or end with punctuation, like C++.
+        self.regex = re.compile(r'(?<!\w)%s(?!\w)' % triePattern(keys), re.IGNORECASE) if keys else None
+
+    def sub(self, repl, text):
+        if self.regex is None:
+            return text
+        return self.regex.sub(repl, text)
+
+    def finditer(self, text):
+        if self.regex is None:
+            return iter(())
+        return self.regex.finditer(text)
+
+
+class Censor(object):
+    """
+    Masks the censored words of the configuration. The list is read again at most every
+    CHECK_SECS, or on the next caption after reload(), and rebuilt only when it changed.
+    """
+
+    def __init__(self, char="*"):
+        self.char = char
+        self._words = ()
+        self._matcher = WordMatcher(())
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def reload(self):
+        """ Reads the censored words again on the next caption, as after they are saved. """
+        with self._lock:
+            self._checked = None
+
+    def matcher(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._checked is not None and now - self._checked < CHECK_SECS:
+                return self._matcher
+            self._checked = now
+            words = tuple(speakreader.CONFIG.CENSORED_WORDS)
+            if words != self._words:
+                self._matcher = WordMatcher(word for word in words if len(word) > 1)
+                self._words = words
+            return self._matcher
+
+    def _mask(self, match):
+        return match.group()[0] + self.char * (len(match.group()) - 1)
+
+    def __call__(self, text):
+        """ Returns the text with all but the first letter of each censored word masked. """
+        return self.matcher().sub(self._mask, text)
+
+    def words(self, words):
+        """ Returns a list of words censored in one pass over them joined by newlines. """
+        matcher = self.matcher()
+        if matcher.regex is None or not words:
+            return list(words)
+        if any("\n" in word for word in words):
+            return [matcher.sub(self._mask, word) for word in words]
+        return matcher.sub(self._mask, "\n".join(words)).split("\n")